@@ -0,0 +1,201 @@
+#!/usr/bin/python
+
+#
+# Copyright 2013 Guillermo Barriga Placencia <gbarrigap@yahoo.es>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# This script benchmarks the ways of calculating CRC32 hashes this
+# project has grown: fck.py (by chunks, with and without mmap), reading
+# the whole file at once with binascii, and the "crc32" binary used by
+# fck.old.py and crc32_old().
+#
+# Synthetic files of the requested sizes are generated, dense (random
+# data) and sparse (holes only), and every backend is run on each of
+# them in a separate process, measuring its wall time, throughput and
+# peak memory. Startup cost is measured on an empty file.
+#
+# Usage: see function "setup_parser".
+#
+
+import sys
+import argparse
+import os
+import json
+import time
+import platform
+import tempfile
+import shutil
+import subprocess # Replaces os.command
+import distutils.spawn
+
+from mediatools.arguments import positive_int, size_type
+
+# Init some global variables.
+DEBUG = False
+HERE = os.path.dirname(os.path.abspath(__file__))
+FCK = os.path.join(HERE, "fck.py")
+FCK_OLD = os.path.join(HERE, "fck.old.py")
+DEFAULT_SIZES = "1K,1M,64M"
+DEFAULT_CHUNK_SIZES = "65536,1048576,16777216"
+BLOCK_SIZE = 2**20 # Random data is written in blocks of this size.
+
+# The same calculation crc32() did before reading files by chunks.
+SINGLE_READ = "import binascii, sys; print '%08X' % (binascii.crc32(open(sys.argv[1], 'rb').read()) & 0xffffffff)"
+
+if DEBUG: print sys.argv
+
+def sizes_type(value):
+    return [size_type(size) for size in value.split(",")]
+
+def backends(chunk_sizes):
+    # Returns (name, chunk_size, command) tuples for every backend
+    # available; the filename to hash is appended to the command.
+    fck = [sys.executable, FCK, "check", "--force", "--no-cache"]
+
+    for chunk_size in chunk_sizes:
+        yield "fck", chunk_size, fck + ["--chunk-size", str(chunk_size)]
+        yield "fck-mmap", chunk_size, fck + ["--chunk-size", str(chunk_size), "--mmap"]
+
+    yield "single-read", None, [sys.executable, "-c", SINGLE_READ]
+
+    # Both crc32_old() and fck.old.py depend on this binary.
+    if distutils.spawn.find_executable("crc32"):
+        yield "crc32-binary", None, ["crc32"]
+        yield "fck.old", None, [sys.executable, FCK_OLD, "check", "--force"]
+
+def make_file(filename, size, sparse):
+    # Sparse files are made of holes only; dense files are filled with
+    # random data, a block at a time.
+    with open(filename, "wb") as output_file:
+        if sparse:
+            output_file.truncate(size)
+            return
+
+        block = os.urandom(min(size, BLOCK_SIZE))
+        left = size
+
+        while left > 0:
+            output_file.write(block[:left])
+            left -= len(block)
+
+def drop_caches():
+    # Makes the kernel forget cached file data, so files are actually
+    # read from disk. Needs root; returns False if it was not possible.
+    try:
+        subprocess.check_call(["sync"])
+
+        with open("/proc/sys/vm/drop_caches", "w") as drop_file:
+            drop_file.write("3\n")
+
+        return True
+
+    except EnvironmentError:
+        return False
+
+def run(command, cold):
+    # Runs the command in a new process, returning its wall time in
+    # seconds and its peak resident memory in KB.
+    if cold: drop_caches()
+
+    with open(os.devnull, "w") as devnull:
+        start = time.time()
+        process = subprocess.Popen(command, stdout = devnull, stderr = devnull)
+        pid, status, rusage = os.wait4(process.pid, 0)
+        elapsed = time.time() - start
+
+    # ru_maxrss is in KB on Linux, but in bytes on OS X.
+    max_rss = rusage.ru_maxrss / 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+
+    return elapsed, max_rss, os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+
+def benchmark(args):
+    directory = args.dir or tempfile.mkdtemp(prefix = "fckbench-")
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    report = {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.sysconf("SC_NPROCESSORS_ONLN"),
+        "repeat": args.repeat,
+        "cold_cache": args.cold and drop_caches(),
+        "startup": [],
+        "results": [],
+    }
+
+    try:
+        # Startup cost, on an empty file.
+        empty = os.path.join(directory, "empty.bin")
+        make_file(empty, 0, False)
+
+        for name, chunk_size, command in backends(args.chunk_sizes):
+            elapsed, max_rss, status = min(run(command + [empty], False) for n in range(args.repeat))
+            report["startup"].append({"backend": name, "chunk_size": chunk_size, "seconds": elapsed, "max_rss_kb": max_rss})
+
+            if not args.quiet: print >> sys.stderr, "startup {} {}: {:.3f}s".format(name, chunk_size or "", elapsed)
+
+        for size in args.sizes:
+            for kind in ("dense", "sparse"):
+                if kind == "sparse" and args.dense_only:
+                    continue
+
+                filename = os.path.join(directory, "{}-{}.bin".format(kind, size))
+                make_file(filename, size, kind == "sparse")
+
+                for name, chunk_size, command in backends(args.chunk_sizes):
+                    # Keep the best of the runs; slower ones are noise.
+                    elapsed, max_rss, status = min(run(command + [filename], args.cold) for n in range(args.repeat))
+                    throughput = size / elapsed if elapsed > 0 else None
+
+                    report["results"].append({"backend": name, "chunk_size": chunk_size, "file": kind, "size": size,
+                                              "seconds": elapsed, "bytes_per_second": throughput, "max_rss_kb": max_rss,
+                                              "exit_status": status})
+
+                    if not args.quiet:
+                        print >> sys.stderr, "{} {} {} {}: {:.3f}s, {:.1f} MB/s, {} KB".format(
+                            name, chunk_size or "", kind, size, elapsed, (throughput or 0) / 2.0**20, max_rss)
+
+                os.remove(filename)
+
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory)
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    json.dump(report, output, indent = 2, sort_keys = True)
+    output.write("\n")
+
+def setup_parser():
+    parser = argparse.ArgumentParser(description = "Benchmarks the CRC32 backends of fck.")
+    parser.add_argument("-s", "--sizes",       type = sizes_type, default = sizes_type(DEFAULT_SIZES), help = "Comma separated sizes of the files to hash, e.g. 1K,1M,2G.")
+    parser.add_argument("-c", "--chunk-sizes", type = sizes_type, default = sizes_type(DEFAULT_CHUNK_SIZES), help = "Comma separated chunk sizes to try with fck.py.")
+    parser.add_argument("-r", "--repeat",      type = positive_int, default = 3, help = "Runs each benchmark this many times, keeping the best.")
+    parser.add_argument("-d", "--dir",                                 help = "Directory for the synthetic files (default: a temporary one).")
+    parser.add_argument("-o", "--output",                              help = "File where the JSON report is written (default: standard output).")
+    parser.add_argument("--dense-only",        action = "store_true", help = "Does not benchmark sparse files.")
+    parser.add_argument("--cold",              action = "store_true", help = "Drops the page cache before each run (needs root).")
+    parser.add_argument("-q", "--quiet",       action = "store_true", help = "Does not show results as they are measured.")
+    parser.set_defaults(func = benchmark)
+
+    return parser
+
+parser = setup_parser()
+args = parser.parse_args()
+args.func(args) # Executes the default function associated to the chosen operation.
+
+sys.exit(0)
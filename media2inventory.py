@@ -1,5 +1,6 @@
 #!/usr/bin/python
 
+
 #
 # Copyright 2013 Guillermo Barriga Placencia <gbarrigap@yahoo.es>
 #
@@ -17,37 +18,16 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # 
 
-import sys
-import argparse
-import os
-import re
-import subprocess # Replaces os.command
-import glob
-
-# Init some global variables.
-DEBUG = True
-
-def video_file(f):
-    return f.endswith(".mkv") or f.endswith(".mp4")
 
-def make_inventory(args):
-    mediainfo_str = "mediainfo --Output=XML"
-    for f in filter(os.path.isdir, args.FILES):
-        for v in filter(video_file, os.listdir(f)):
-            mediainfo_str += ' "{}/{}"'.format(f, v)
-    
-    print mediainfo_str
-
-def setup_parser():
-    parser = argparse.ArgumentParser()
-    # parser.add_argument("-o", "--output=")
-    parser.add_argument("FILES", nargs = "+")
-    parser.set_defaults(func = make_inventory)
+#
+# Makes an inventory of video files with mediainfo; see
+# mediatools/media2inventory.py. Also available as
+# "python -m mediatools inventory".
+#
 
-    return parser
+import sys
 
-parser = setup_parser()
-args = parser.parse_args()
-args.func(args) # Executes the default function associated to the chosen operation.
+from mediatools import media2inventory
 
-sys.exit(1)
+if __name__ == "__main__":
+    sys.exit(media2inventory.main())
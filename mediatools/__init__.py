@@ -0,0 +1,24 @@
+
+#
+# Copyright 2013 Guillermo Barriga Placencia <gbarrigap@yahoo.es>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# 
+
+
+#
+# Shared code of the scripts in this repository: fck, vidcat and
+# media2inventory. The modules of the package are not imported here, so
+# running one of the commands only loads what it needs; see cli.py.
+#
@@ -0,0 +1,45 @@
+
+#
+# Copyright 2013 Guillermo Barriga Placencia <gbarrigap@yahoo.es>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# 
+
+
+#
+# Types of command line arguments shared by the commands.
+#
+
+import argparse
+import re
+
+def positive_int(value):
+    # Validates numeric arguments such as --chunk-size or --jobs.
+    number = int(value)
+
+    if number <= 0:
+        raise argparse.ArgumentTypeError("{} is not a positive number".format(value))
+
+    return number
+
+SIZE_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+def size_type(value):
+    # Parses sizes such as "512", "1K", "64M" or "2G".
+    match = re.match("^([0-9]+)([KMGT]?)$", value.upper())
+
+    if not match:
+        raise argparse.ArgumentTypeError("{} is not a valid size".format(value))
+
+    return int(match.group(1)) * SIZE_UNITS[match.group(2)]
@@ -0,0 +1,59 @@
+
+#
+# Copyright 2013 Guillermo Barriga Placencia <gbarrigap@yahoo.es>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# 
+
+
+#
+# Single entry point for the commands of this package:
+#
+#     python -m mediatools COMMAND [ARGUMENTS]
+#
+# Commands are only imported when they are run, so starting up does not
+# pay for the modules of the rest; it matters when a command is run
+# thousands of times from cron or find.
+#
+
+import sys
+import importlib
+
+# Name, module and description of each command.
+COMMANDS = [
+    ("fck",       "mediatools.fck",             "Checks or generates CRC32 hashes of files."),
+    ("vidcat",    "mediatools.vidcat",          "Concatenates video segments into a single file."),
+    ("inventory", "mediatools.media2inventory", "Makes an inventory of video files with mediainfo."),
+]
+
+def usage():
+    lines = ["Usage: mediatools COMMAND [ARGUMENTS]", "", "Commands:"]
+    lines.extend("    {:<12}{}".format(name, description) for name, module, description in COMMANDS)
+    lines.extend(["", "Run 'mediatools COMMAND --help' for the arguments of each command."])
+
+    return "\n".join(lines)
+
+def main(argv = None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if not argv or argv[0] in ("-h", "--help"):
+        print usage()
+        return 0 if argv else 2
+
+    for name, module, description in COMMANDS:
+        if argv[0] == name:
+            return importlib.import_module(module).main(argv[1:], prog = "mediatools " + name)
+
+    print >> sys.stderr, "Unknown command: {}\n\n{}".format(argv[0], usage())
+    return 2
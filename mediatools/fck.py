@@ -0,0 +1,1745 @@
+#
+# Copyright 2013 Guillermo Barriga Placencia <gbarrigap@yahoo.es>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# 
+
+#
+# This scripts should be used to create or check CRC32 hashes
+# associated to the file(s) specified by the user.
+#
+# Usage: see function "setup_parser".
+#
+
+import sys
+import argparse
+import os
+import re
+import hashlib
+import collections
+import stat
+import fnmatch
+import time
+import itertools
+
+from mediatools.arguments import positive_int, size_type
+from mediatools.files import list_dir, walk_files
+from mediatools.hashes import CRC32, format_hash, get_hashed_filename
+from mediatools.prompts import confirm
+
+# Init some global variables.
+DEBUG = False
+CRC32_REGEX = r"[\[(][0-9A-Fa-f]{8}[\])]" # As in "name_[1A2B3C4D].mkv".
+DEFAULT_FILE_CHUNK_SIZE = 2**20 # 1MB
+FILES_PER_JOB = 4 # How many files each worker may have queued ahead.
+PROGRESS_INTERVAL = 0.5 # Seconds between progress updates.
+DEFAULT_CACHE_FILE = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "fck", "hashes.sqlite")
+DEFAULT_JOURNAL_DIR = os.path.join(os.environ.get("XDG_DATA_HOME", os.path.expanduser("~/.local/share")), "fck", "journals")
+JOURNAL_EXTENSION = ".journal"
+DEDUPE_SAMPLE_SIZE = 2**16 # 64KB, read from the head and tail of same-size files.
+DEDUPE_BATCH_SIZE = 1000 # Files indexed at once.
+DEDUPE_ALGORITHMS = ("sha256",) # Duplicates may be replaced, so CRC32 collisions are not an option.
+DEFAULT_SCRUB_STATE = os.path.join(os.environ.get("XDG_DATA_HOME", os.path.expanduser("~/.local/share")), "fck", "scrub.sqlite")
+DEFAULT_SCRUB_PERIOD = 30 # Days in which every file is verified once.
+SCRUB_BATCH_SIZE = 1000 # Files recorded at once.
+DAY = 24 * 60 * 60
+IONICE_CLASSES = {"idle": "3", "best-effort": "2"}
+
+# Available hash algorithms, and the extension of their manifest files.
+HASH_ALGORITHMS = collections.OrderedDict([
+    ("crc32",  (CRC32,          ".sfv")),
+    ("md5",    (hashlib.md5,    ".md5")),
+    ("sha1",   (hashlib.sha1,   ".sha1")),
+    ("sha256", (hashlib.sha256, ".sha256")),
+])
+DEFAULT_ALGORITHMS = ("crc32",)
+
+def algorithms_type(value):
+    # Validates the --algo argument, e.g. "crc32,md5,sha256".
+    algorithms = []
+
+    for algorithm in value.lower().split(","):
+        if algorithm not in HASH_ALGORITHMS:
+            raise argparse.ArgumentTypeError("unknown algorithm {}, choose from {}".format(algorithm, ", ".join(HASH_ALGORITHMS)))
+
+        if algorithm not in algorithms:
+            algorithms.append(algorithm)
+
+    return tuple(algorithms)
+
+def new_hasher(algorithm):
+    return HASH_ALGORITHMS[algorithm][0]()
+
+def hash_regex(algorithm):
+    # Hashes are tagged in brackets, or parentheses.
+    return r"[\[(][0-9A-Fa-f]{%d}[\])]" % (new_hasher(algorithm).digest_size * 2)
+
+class HashCache(object):
+    # Persistent store of the hashes already calculated, kept in a SQLite
+    # database so several fck processes can share it safely. An entry is
+    # only used while the size, mtime and inode of its file are the same
+    # as when it was hashed.
+
+    def __init__(self, filename, rehash = False):
+        import sqlite3
+
+        directory = os.path.dirname(filename)
+
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.rehash = rehash
+        self.db = sqlite3.connect(filename, timeout = 60)
+        self.db.text_factory = str # Filenames are not always valid UTF-8.
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS digests (path TEXT, algorithm TEXT, size INTEGER, mtime REAL, inode INTEGER, digest TEXT, PRIMARY KEY (path, algorithm))")
+        self.db.commit()
+
+    def lookup(self, filename, algorithms = DEFAULT_ALGORITHMS, st = None):
+        # Returns the key of the file in its current state, and its cached
+        # digests, or None if any of them must be (re)calculated.
+        st = st or os.stat(filename)
+        key = (st.st_size, st.st_mtime, st.st_ino)
+
+        if self.rehash:
+            return key, None
+
+        rows = self.db.execute("SELECT algorithm, size, mtime, inode, digest FROM digests WHERE path = ?", (os.path.abspath(filename),))
+        cached = dict((row[0], row[4]) for row in rows if tuple(row[1:4]) == key)
+
+        if not all(algorithm in cached for algorithm in algorithms):
+            return key, None
+
+        return key, collections.OrderedDict((algorithm, cached[algorithm]) for algorithm in algorithms)
+
+    def store(self, filename, key, digests):
+        path = os.path.abspath(filename)
+
+        self.db.executemany("INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)",
+                            [(path, algorithm) + key + (digest,) for algorithm, digest in digests.items()])
+        self.db.commit()
+
+    def rename(self, filename_old, filename_new):
+        self.db.execute("DELETE FROM digests WHERE path = ?", (os.path.abspath(filename_new),))
+        self.db.execute("UPDATE digests SET path = ? WHERE path = ?", (os.path.abspath(filename_new), os.path.abspath(filename_old)))
+        self.db.commit()
+
+    def prune(self):
+        # Evicts the entries of files that no longer exist.
+        paths = [row[0] for row in self.db.execute("SELECT DISTINCT path FROM digests")]
+        deleted = [(path,) for path in paths if not os.path.isfile(path)]
+
+        self.db.executemany("DELETE FROM digests WHERE path = ?", deleted)
+        self.db.commit()
+
+        return len(deleted)
+
+    def clear(self):
+        self.db.execute("DELETE FROM digests")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+def open_cache(args):
+    # Returns the hash cache requested by the user, or None.
+    if args.no_cache:
+        return None
+
+    return HashCache(args.cache, getattr(args, "force_rehash", False))
+
+def update_mmap(input_file, hashers, chunk_size = DEFAULT_FILE_CHUNK_SIZE, progress = None):
+    # Updates the received hashers with the contents of the file, mapping
+    # it into memory and hashing buffers over the mapping, which avoids
+    # copying the data into strings. Returns False when the file cannot
+    # be mapped (pipes, empty files, some FUSE mounts...).
+    import mmap
+
+    if not stat.S_ISREG(os.fstat(input_file.fileno()).st_mode):
+        return False
+
+    try:
+        mapped = mmap.mmap(input_file.fileno(), 0, access = mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError, mmap.error):
+        return False
+
+    try:
+        for offset in xrange(0, len(mapped), chunk_size):
+            chunk = buffer(mapped, offset, chunk_size)
+
+            for hasher in hashers:
+                hasher.update(chunk)
+
+            if progress: progress(len(chunk))
+
+        return True
+
+    finally:
+        mapped.close()
+
+def file_digests(filename, algorithms = DEFAULT_ALGORITHMS, chunk_size = DEFAULT_FILE_CHUNK_SIZE, cache = None, use_mmap = False, st = None, stats = None, progress = None):
+    # Calculates the digests of the received file with every algorithm
+    # requested, in a single pass over its contents. The file is read by
+    # chunks, so memory usage does not depend on its size.
+    #
+    # When a stats dict is received, it is filled with the bytes hashed
+    # and the time spent reading and hashing them (with mmap, reading
+    # happens while hashing). progress is called with the size of each
+    # chunk as it is hashed.
+    if cache:
+        key, digests = cache.lookup(filename, algorithms, st)
+
+        if digests is None:
+            digests = file_digests(filename, algorithms, chunk_size, use_mmap = use_mmap, stats = stats, progress = progress)
+            cache.store(filename, key, digests)
+
+        elif stats is not None:
+            stats.update(bytes = 0, read_time = 0.0, hash_time = 0.0, cached = True)
+
+        return digests
+
+    hashers = [new_hasher(algorithm) for algorithm in algorithms]
+    size, read_time, hash_time = 0, 0.0, 0.0
+
+    with open(filename, "rb") as input_file:
+        start = time.time()
+
+        if use_mmap and update_mmap(input_file, hashers, chunk_size, progress):
+            size = os.fstat(input_file.fileno()).st_size
+            hash_time = time.time() - start
+
+        # Fall back to buffered reads when mmap is off or not possible.
+        else:
+            while True:
+                start = time.time()
+                chunk = input_file.read(chunk_size)
+                read_end = time.time()
+                read_time += read_end - start
+
+                if not chunk:
+                    break
+
+                for hasher in hashers:
+                    hasher.update(chunk)
+
+                hash_time += time.time() - read_end
+                size += len(chunk)
+
+                if progress: progress(len(chunk))
+
+    if stats is not None:
+        stats.update(bytes = size, read_time = read_time, hash_time = hash_time, cached = False)
+
+    return collections.OrderedDict((algorithm, hasher.hexdigest().upper()) for algorithm, hasher in zip(algorithms, hashers))
+
+def crc32(filename, chunk_size = DEFAULT_FILE_CHUNK_SIZE, cache = None, use_mmap = False):
+    return file_digests(filename, ("crc32",), chunk_size, cache, use_mmap)["crc32"]
+
+def hash_error(filename, error, monitor = None, errors = None):
+    # Reports a file that could not be hashed, which is left out; its name
+    # is added to errors, if given.
+    if monitor: monitor.clear()
+
+    print >> sys.stderr, "{} [Error] {}".format(filename, error.strerror)
+
+    if errors is not None:
+        errors.append(filename)
+
+def stat_files(files, monitor = None, errors = None):
+    # Passes the received (filename, st) tuples through, with the stat of
+    # each file, leaving out the files that no longer exist.
+    for filename, st in files:
+        if st is None:
+            try:
+                st = os.stat(filename)
+            except EnvironmentError as error:
+                hash_error(filename, error, monitor, errors)
+                continue
+
+        yield filename, st
+
+def hash_task(task):
+    # Runs in a worker process; errors are sent back to the parent
+    # instead of being raised, so the pool keeps going.
+    index, filename, algorithms, chunk_size, use_mmap = task
+    stats = {}
+
+    try:
+        return index, file_digests(filename, algorithms, chunk_size, use_mmap = use_mmap, stats = stats), stats, None
+    except EnvironmentError as error:
+        return index, None, None, error
+
+class Monitor(object):
+    # Follows the progress of a run: shows the bytes hashed, throughput,
+    # ETA and current file on standard error, and/or writes the stats of
+    # every file hashed as JSON, as they are finished.
+
+    def __init__(self, progress = False, stats_file = None):
+        self.progress = progress
+        self.stats_file = stats_file
+        self.start_time = time.time()
+        self.last_shown = 0
+        self.line_shown = False
+        self.current = None
+        self.files = 0
+        self.total_size = 0       # Size of the files discovered so far.
+        self.total_known = False  # True when every file was discovered.
+        self.done_size = 0        # Size of the files finished, hashed or cached.
+        self.hashed_bytes = 0     # Bytes actually read, including files in progress.
+        self.read_time = 0.0
+        self.hash_time = 0.0
+
+        if self.stats_file:
+            self.stats_file.write('{"files": [')
+
+    def discover(self, files):
+        # Passes the received (filename, st) tuples through, adding up
+        # their sizes to estimate the time left.
+        for filename, st in files:
+            st = st or os.stat(filename)
+            self.total_size += st.st_size
+
+            yield filename, st
+
+        self.total_known = True
+
+    def start(self, filename):
+        self.current = filename
+        self.show()
+
+    def advance(self, size):
+        self.hashed_bytes += size
+        self.show()
+
+    def finish(self, filename, size, stats, in_progress = True):
+        import json
+
+        # Bytes of files hashed by this process were already counted as
+        # they were read.
+        if not in_progress:
+            self.hashed_bytes += stats["bytes"]
+
+        self.files += 1
+        self.done_size += size
+        self.read_time += stats["read_time"]
+        self.hash_time += stats["hash_time"]
+
+        if self.stats_file:
+            self.clear()
+            self.stats_file.write("{}\n  {}".format("," if self.files > 1 else "", json.dumps(dict(stats, filename = filename, size = size), sort_keys = True)))
+
+        self.show()
+
+    def throughput(self):
+        elapsed = time.time() - self.start_time
+        return self.hashed_bytes / elapsed if elapsed > 0 else 0.0
+
+    def show(self, force = False):
+        if not self.progress or (not force and time.time() - self.last_shown < PROGRESS_INTERVAL):
+            return
+
+        self.last_shown = time.time()
+        throughput = self.throughput()
+        left = self.total_size - self.done_size
+
+        if self.total_known and throughput:
+            eta = "{}:{:02}".format(*divmod(int(left / throughput), 60))
+        else:
+            eta = "--:--"
+
+        line = "{:.1f} MB hashed, {:.1f} MB/s, ETA {}, {}".format(self.hashed_bytes / 2.0**20, throughput / 2.0**20, eta, self.current or "")
+
+        self.clear()
+        sys.stderr.write(line[:200])
+        sys.stderr.flush()
+        self.line_shown = True
+
+    def clear(self):
+        if self.line_shown:
+            sys.stderr.write("\r\033[K")
+            self.line_shown = False
+
+    def close(self):
+        if self.progress:
+            self.show(True)
+            sys.stderr.write("\n")
+            self.line_shown = False
+
+        if self.stats_file:
+            import json
+
+            elapsed = time.time() - self.start_time
+            total = {"files": self.files, "bytes": self.hashed_bytes, "elapsed": elapsed,
+                     "bytes_per_second": self.throughput(), "read_time": self.read_time, "hash_time": self.hash_time}
+
+            self.stats_file.write('\n], "total": {}}}\n'.format(json.dumps(total, sort_keys = True)))
+            self.stats_file.flush()
+
+            if self.stats_file is not sys.stderr:
+                self.stats_file.close()
+
+def open_monitor(args):
+    # Returns the monitor requested by the user, or None.
+    if not (args.progress or args.stats):
+        return None
+
+    if not args.stats:
+        stats_file = None
+    elif args.stats_file == "-":
+        # Both would be written to standard error, mixed up.
+        if args.progress:
+            sys.exit("--progress needs --stats-file, as the progress is shown on standard error.")
+
+        stats_file = sys.stderr
+    else:
+        stats_file = open(args.stats_file, "w")
+
+    return Monitor(args.progress, stats_file)
+
+def hashed_files(files, chunk_size = DEFAULT_FILE_CHUNK_SIZE, jobs = 1, per_device = None, cache = None, use_mmap = False, algorithms = DEFAULT_ALGORITHMS, monitor = None, errors = None):
+    # Receives (filename, st) tuples, where st is the stat of the file or
+    # None if it is not known yet, and yields (filename, digests) tuples in
+    # the same order; digests is an ordered dict with the digest of each of
+    # the requested algorithms. Files are taken lazily, so hashing starts
+    # before a long list of files has been fully discovered.
+    #
+    # With more than one job, files are hashed by a pool of worker
+    # processes; per_device limits how many of them may read from the
+    # same device (disk) at the same time.
+    #
+    # The monitor, if any, is told about each file as it starts and ends.
+    # Files that cannot be read are reported, added to errors if given,
+    # and left out.
+    files = stat_files(files, monitor, errors)
+
+    if monitor:
+        files = monitor.discover(files)
+
+    if jobs <= 1:
+        for filename, st in files:
+            stats = {}
+
+            try:
+                if not monitor:
+                    digests = file_digests(filename, algorithms, chunk_size, cache, use_mmap, st)
+                else:
+                    monitor.start(filename)
+                    digests = file_digests(filename, algorithms, chunk_size, cache, use_mmap, st, stats, monitor.advance)
+                    monitor.finish(filename, st.st_size, stats)
+
+            except EnvironmentError as error:
+                hash_error(filename, error, monitor, errors)
+                continue
+
+            yield filename, digests
+
+        return
+
+    import multiprocessing
+    import Queue
+
+    files = iter(files)
+    exhausted = False
+
+    entries = {}  # index -> (filename, st, cache key)
+    results = {}  # index -> digests
+    pending = collections.OrderedDict() # device -> deque of indexes
+    reading = collections.Counter()
+    finished = Queue.Queue()
+    taken = next_index = running = 0
+
+    pool = multiprocessing.Pool(jobs)
+
+    try:
+        while True:
+            # Take new files while the queue ahead of the workers is short,
+            # answering from the cache when possible.
+            while not exhausted and taken - next_index < jobs * FILES_PER_JOB:
+                try:
+                    filename, st = next(files)
+                except StopIteration:
+                    exhausted = True
+                    break
+
+                key, digests = cache.lookup(filename, algorithms, st) if cache else (None, None)
+
+                if digests is None:
+                    # Queue the files of each device, keeping their order.
+                    pending.setdefault(st.st_dev, collections.deque()).append(taken)
+                else:
+                    results[taken] = digests
+
+                    if monitor:
+                        monitor.finish(filename, st.st_size, {"bytes": 0, "read_time": 0.0, "hash_time": 0.0, "cached": True})
+
+                entries[taken] = (filename, st, key)
+                taken += 1
+
+            # Keep every worker busy, favouring the earliest pending file
+            # among the devices that are not at their limit.
+            while running < jobs:
+                available = [device for device, queue in pending.items()
+                             if queue and not (per_device and reading[device] >= per_device)]
+
+                if not available:
+                    break
+
+                device = min(available, key = lambda device: pending[device][0])
+                index = pending[device].popleft()
+                reading[device] += 1
+                running += 1
+
+                if monitor:
+                    monitor.start(entries[index][0])
+
+                pool.apply_async(hash_task, [(index, entries[index][0], algorithms, chunk_size, use_mmap)], callback = finished.put)
+
+            # Yield every result that is already available, in order.
+            while next_index in results:
+                filename, digests = entries.pop(next_index)[0], results.pop(next_index)
+                next_index += 1
+
+                if digests is not None:
+                    yield filename, digests
+
+            if exhausted and next_index == taken:
+                break
+
+            if running:
+                index, digests, stats, error = finished.get()
+                filename, st, key = entries[index]
+                reading[st.st_dev] -= 1
+                running -= 1
+                results[index] = digests
+
+                if error:
+                    hash_error(filename, error, monitor, errors)
+                    continue
+
+                if cache:
+                    cache.store(filename, key, digests)
+
+                if monitor:
+                    monitor.finish(filename, st.st_size, stats, in_progress = False)
+
+    finally:
+        pool.terminate()
+        pool.join()
+
+def discover_files(args):
+    # Yields (filename, st) tuples for the files received as arguments,
+    # walking directories when running recursively.
+    for path in args.FILES:
+        if args.recursive and os.path.isdir(path):
+            for item in walk_files(path, args.include, args.exclude):
+                yield item
+
+        elif os.path.isfile(path):
+            name = os.path.basename(path)
+
+            if args.exclude and any(fnmatch.fnmatch(name, pattern) for pattern in args.exclude):
+                continue
+
+            if not args.include or any(fnmatch.fnmatch(name, pattern) for pattern in args.include):
+                yield path, None
+
+def crc32_old(filename):
+    import subprocess
+
+    file_crc32 = subprocess.check_output(["crc32", filename])
+    file_crc32 = file_crc32.rstrip() # Removes the newline character
+    return str.upper(file_crc32)
+
+def is_hashed(filename):
+    return re.search(CRC32_REGEX, os.path.basename(filename))
+
+def hashed(filename, algorithms = DEFAULT_ALGORITHMS):
+    # Only the name of the file counts, not the directories it is in.
+    name = os.path.basename(filename)
+
+    return all(re.search(hash_regex(algorithm), name) for algorithm in algorithms)
+
+def is_not_hashed(filename):
+    return not hashed(filename)
+
+def is_hash_ok(filename, chunk_size = DEFAULT_FILE_CHUNK_SIZE):
+    return cksum_ok(filename, crc32(filename, chunk_size))
+
+def hash_ok(filename, chunk_size = DEFAULT_FILE_CHUNK_SIZE, cache = None):
+    return cksum_ok(filename, crc32(filename, chunk_size, cache))
+
+def cksum_ok(filename, cksum):
+    name = os.path.basename(filename).upper()
+
+    return "[{}]".format(cksum.upper()) in name or "({})".format(cksum.upper()) in name
+
+def digests_ok(filename, digests):
+    return all(cksum_ok(filename, digest) for digest in digests.values())
+
+def manifest_filename(directory, algorithm):
+    # Each directory gets a manifest per algorithm named after it, e.g.
+    # "show/show.sfv" or "show/show.md5".
+    return os.path.join(directory, os.path.basename(os.path.abspath(directory)) + HASH_ALGORITHMS[algorithm][1])
+
+def manifest_algorithm(filename):
+    # Returns the algorithm of the received manifest file, or None if it
+    # is not a manifest.
+    for algorithm, (_, extension) in HASH_ALGORITHMS.items():
+        if filename.lower().endswith(extension):
+            return algorithm
+
+    return None
+
+def read_manifest(filename):
+    # Returns an ordered dict with the digest of each file listed in the
+    # received manifest, indexed by filename. SFV files list "name CRC32";
+    # the others use the md5sum format, "digest  name" or "digest *name".
+    sfv = manifest_algorithm(filename) == "crc32"
+    entries = collections.OrderedDict()
+
+    with open(filename) as manifest_file:
+        for line in manifest_file:
+            line = line.rstrip("\r\n")
+
+            # Skip comments and blank lines.
+            if not line.strip() or line.startswith(";") or line.startswith("#"):
+                continue
+
+            # Filenames may contain spaces, digests never do.
+            if sfv:
+                name, digest = line.rsplit(None, 1)
+            else:
+                digest, name = line.split(None, 1)
+                name = name[1:] if name.startswith("*") else name
+
+            entries[name] = digest.upper()
+
+    return entries
+
+def write_manifest(filename, entries):
+    # Writes the manifest to a temporary file first, so an interrupted run
+    # never leaves a truncated manifest behind.
+    sfv = manifest_algorithm(filename) == "crc32"
+    filename_tmp = filename + ".tmp"
+
+    with open(filename_tmp, "w") as manifest_file:
+        if sfv:
+            manifest_file.write("; Generated by fck.py\n")
+
+        for name, digest in entries.items():
+            if sfv:
+                manifest_file.write("{} {}\n".format(name, digest))
+            else:
+                manifest_file.write("{}  {}\n".format(digest.lower(), name))
+
+    os.rename(filename_tmp, filename)
+
+def update_manifest(directory, algorithm, entries):
+    # Adds the received entries to the manifest of the directory,
+    # replacing the ones of files already listed.
+    filename = manifest_filename(directory, algorithm)
+    manifest = read_manifest(filename) if os.path.isfile(filename) else collections.OrderedDict()
+    manifest.update(entries)
+    write_manifest(filename, manifest)
+
+    return filename
+
+def manifest_hashes(filenames, algorithms = DEFAULT_ALGORITHMS):
+    # Yields (filename, algorithm, digest) tuples with the expected digests
+    # of the received files, from the manifests of the requested
+    # algorithms. Manifests are expanded to the files they list; any other
+    # file is looked up in the manifests of its directory, which are read
+    # only once.
+    indexes = {}
+
+    for filename in filenames:
+        directory = os.path.dirname(filename)
+        algorithm = manifest_algorithm(filename)
+
+        if algorithm:
+            if algorithm in algorithms:
+                for name, digest in read_manifest(filename).items():
+                    yield os.path.join(directory, name), algorithm, digest
+
+            continue
+
+        if directory not in indexes:
+            indexes[directory] = collections.defaultdict(dict)
+
+            for name in os.listdir(directory or os.curdir):
+                if manifest_algorithm(name) in algorithms:
+                    for listed, digest in read_manifest(os.path.join(directory, name)).items():
+                        indexes[directory][listed][manifest_algorithm(name)] = digest
+
+        for algorithm, digest in indexes[directory].get(os.path.basename(filename), {}).items():
+            yield filename, algorithm, digest
+
+def rename_file(filename_old, filename_new, message = False):
+    os.rename(filename_old, filename_new)
+
+    if message: print message
+
+class RenameJournal(object):
+    # Write-ahead journal of a batch of renames. The whole plan is written
+    # (and synced) before any file is renamed, and every rename is logged
+    # as it is done, so a batch interrupted by a crash can be replayed
+    # with "fck resume", and any batch can be reverted with "fck undo".
+    #
+    # Each line is a JSON record; filenames are stored as latin-1 so any
+    # byte string survives the round trip.
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.renames = []   # (filename_old, filename_new) tuples.
+        self.done = set()   # Indexes of the renames done.
+        self.state = None   # None while pending, then "committed" or "undone".
+        self.journal_file = None
+        self.torn_at = None # Offset of a torn last line, left by a crash.
+
+        if os.path.isfile(filename):
+            self.load()
+
+    def load(self):
+        import json
+
+        offset = 0
+
+        with open(self.filename) as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    self.torn_at = offset
+                    break
+
+                offset += len(line)
+
+                if record["op"] == "rename":
+                    self.renames.append((record["old"].encode("latin-1"), record["new"].encode("latin-1")))
+                elif record["op"] == "done":
+                    self.done.add(record["index"])
+                elif record["op"] == "undo":
+                    self.done.discard(record["index"])
+                else:
+                    self.state = record["op"]
+
+    def log(self, *records):
+        import json
+
+        if not self.journal_file:
+            directory = os.path.dirname(self.filename)
+
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            self.journal_file = open(self.filename, "a")
+
+            # Drop a torn line before logging anything after it.
+            if self.torn_at is not None:
+                self.journal_file.truncate(self.torn_at)
+
+        for record in records:
+            self.journal_file.write(json.dumps(record, encoding = "latin-1", sort_keys = True) + "\n")
+
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+
+    def plan(self, renames):
+        self.renames = [(os.path.abspath(old), os.path.abspath(new)) for old, new in renames]
+        self.log(*[{"op": "rename", "old": old, "new": new} for old, new in self.renames])
+
+    def apply(self, callback = None):
+        # Does the pending renames, in order, calling callback(old, new)
+        # after each one. Renames found already done (the crash happened
+        # before they were logged) are logged; conflicting or failing ones
+        # skipped.
+        for index, (old, new) in enumerate(self.renames):
+            if index in self.done:
+                continue
+
+            if os.path.exists(old) and not os.path.exists(new):
+                try:
+                    os.rename(old, new)
+                except OSError as error:
+                    print >> sys.stderr, "Skipping {} to {}: {}".format(old, new, error.strerror)
+                    continue
+
+            elif os.path.exists(old) or not os.path.exists(new):
+                print >> sys.stderr, "Skipping {} to {}: {}".format(old, new, "target exists" if os.path.exists(new) else "file not found")
+                continue
+
+            self.done.add(index)
+            self.log({"op": "done", "index": index})
+
+            if callback: callback(old, new)
+
+        self.state = "committed"
+        self.log({"op": self.state})
+
+    def undo(self, callback = None):
+        # Reverts the renames done, newest first.
+        for index in sorted(self.done, reverse = True):
+            old, new = self.renames[index]
+
+            try:
+                if os.path.exists(new) and not os.path.exists(old):
+                    os.rename(new, old)
+
+                    if callback: callback(new, old)
+
+                else:
+                    print >> sys.stderr, "Cannot revert {} to {}".format(new, old)
+
+            except OSError as error:
+                print >> sys.stderr, "Cannot revert {} to {}: {}".format(new, old, error.strerror)
+
+            self.done.discard(index)
+            self.log({"op": "undo", "index": index})
+
+        self.state = "undone"
+        self.log({"op": self.state})
+
+    def close(self):
+        if self.journal_file:
+            self.journal_file.close()
+
+def new_journal_filename(directory):
+    return os.path.join(directory, "{}-{}{}".format(time.strftime("%Y%m%d-%H%M%S"), os.getpid(), JOURNAL_EXTENSION))
+
+def latest_journal(directory, states):
+    # Returns the newest journal of the directory in one of the received
+    # states, or None.
+    if not os.path.isdir(directory):
+        return None
+
+    for name in sorted(os.listdir(directory), reverse = True):
+        if name.endswith(JOURNAL_EXTENSION):
+            journal = RenameJournal(os.path.join(directory, name))
+
+            if journal.state in states:
+                return journal
+
+    return None
+
+def checkable_filenames(filenames, force_check):
+    for filename in filenames:
+        if os.path.isfile(filename) and (force_check or hashed(filename)):
+            yield filename
+
+# def check_op_fp(args):
+#     files = ifilter(valid_file if args.force else hashed_file, args.FILES)
+#     files_ok = ifilter(hash_ok, files)
+#     files_fail = ifilterfalse(hash_ok, files)
+
+#     for f in files_fail:
+#         print "{} [Fail]".format(f)
+
+#     if args.verbose:
+#         for f in files_ok:
+#             print "{} [OK]".format(f)
+
+    # print "{} files processed, {} OK, {} Failed".format(len(files_ok) + count_fail, count_ok, count_fail)
+
+# def filter(function, iterable):
+#     for i in iterable:
+#         if function(i):
+#             yield i
+
+# def do_something_if(function, iterable):
+#     for i in iterable:
+#         if function(i):
+#             print "".format(i)
+
+# def show_and_count_ok
+
+def check_op_func(args):
+    files = (f for f in args.FILES if os.path.isfile(f))
+    files_ok = (f for f in args.FILES if hash_ok(f))
+    
+
+def check_op(args):
+    count_ok, count_fail = 0, 0
+
+    if args.from_file:
+        # Check against the digests listed in manifests.
+        expected = collections.OrderedDict()
+        for filename, algorithm, digest in manifest_hashes((f for f, st in discover_files(args)), args.algorithms):
+            expected.setdefault(filename, {})[algorithm] = digest
+
+        files = ((f, None) for f in expected if valid_file(f))
+        matches = lambda filename, digests: all(digests[a] == d for a, d in expected[filename].items())
+
+        for f in expected:
+            if not valid_file(f):
+                count_fail += 1
+                print "{} [Missing]".format(f)
+
+    else:
+        files = ((f, st) for f, st in discover_files(args) if args.force or hashed(f, args.algorithms))
+        matches = digests_ok
+
+    cache = open_cache(args)
+    monitor = open_monitor(args)
+    errors = []
+
+    try:
+        for f, digests in hashed_files(files, args.chunk_size, args.jobs, args.per_device, cache, args.mmap, args.algorithms, monitor, errors):
+            # Keep the progress line apart from the results.
+            if monitor: monitor.clear()
+
+            if matches(f, digests):
+                count_ok += 1
+
+                if args.verbose:
+                    print "{} [OK]".format(f)
+
+            else:
+                count_fail += 1
+                print "{} [Fail]".format(f)
+
+    finally:
+        if monitor: monitor.close()
+
+    if count_ok or count_fail:
+        print "{} files processed, {} OK, {} Failed".format(count_ok + count_fail, count_ok, count_fail)
+    else:
+        print "No hashed files found!"
+
+    return 1 if count_fail or errors else 0
+
+def valid_file(filename):
+    return os.path.isfile(filename)
+
+def hashed_file(filename):
+    return os.path.isfile(filename) and hashed(filename)
+
+def valid_hashed(filename, algorithms = DEFAULT_ALGORITHMS):
+    return valid_file(filename) and hashed(filename, algorithms)
+
+def not_hashed_file(filename):
+    return os.path.isfile(filename) and not hashed(filename)
+
+def generate_op(args):
+    # If --skip, the script will not work on files already hashed.
+    # Manifests are never hashed themselves.
+    files = ((f, st) for f, st in discover_files(args)
+             if not (args.skip and hashed(f, args.algorithms)) and not manifest_algorithm(f))
+
+    delimiter = args.delimiter if args.delimiter else "_"
+    cache = open_cache(args)
+
+    # With --to-file, files are only renamed if --to-filename is also given.
+    to_filename = args.to_filename or not args.to_file
+    manifests = collections.OrderedDict()
+
+    monitor = open_monitor(args)
+
+    # Hash every file first, then rename them all as a single batch.
+    plan = []
+
+    try:
+        for filename, digests in hashed_files(files, args.chunk_size, args.jobs, args.per_device, cache, args.mmap, args.algorithms, monitor):
+            # Tag the filename with every digest, in the order requested.
+            hashed_filename = filename
+            for digest in digests.values():
+                hashed_filename = get_hashed_filename(hashed_filename, digest, delimiter)
+
+            plan.append((filename, hashed_filename, digests))
+
+    finally:
+        if monitor: monitor.close()
+
+    renamed = set()
+
+    def renamed_file(filename_old, filename_new):
+        renamed.add(filename_old)
+
+        # Keep the cached hash for the new name.
+        if cache: cache.rename(filename_old, filename_new)
+
+        if args.yes: print "{} to {}".format(filename_old, filename_new)
+
+    if to_filename and plan:
+        # Unless running quietly or with --yes, show the plan and ask once.
+        # A dry run always shows it.
+        if args.dry_run or not (args.quiet or args.yes):
+            for filename, hashed_filename, digests in plan:
+                print "{} to {}".format(filename, hashed_filename)
+
+        if not args.dry_run and (args.quiet or args.yes or confirm("Rename {} files?".format(len(plan)))):
+            journal = RenameJournal(new_journal_filename(args.journal_dir))
+            journal.plan((filename, hashed_filename) for filename, hashed_filename, digests in plan)
+            journal.apply(renamed_file)
+            journal.close()
+
+    for filename, hashed_filename, digests in plan:
+        # A dry run lists the files under the names they would be given.
+        if os.path.abspath(filename) in renamed or (args.dry_run and to_filename):
+            filename = hashed_filename
+
+        if args.to_file:
+            for algorithm, digest in digests.items():
+                manifests.setdefault((os.path.dirname(filename), algorithm), collections.OrderedDict())[os.path.basename(filename)] = digest
+
+    for (directory, algorithm), entries in manifests.items():
+        if args.dry_run:
+            for name, digest in entries.items():
+                print "{} {} in {}".format(name, digest, manifest_filename(directory, algorithm))
+
+            continue
+
+        manifest = update_manifest(directory, algorithm, entries)
+
+        if not args.quiet:
+            print "{} files listed in {}".format(len(entries), manifest)
+
+def undo_op(args):
+    # Reverts the given journal, or the newest one not reverted yet.
+    journal = RenameJournal(args.JOURNAL) if args.JOURNAL else latest_journal(args.journal_dir, (None, "committed"))
+
+    if not journal or not journal.renames:
+        print "No renames to undo!"
+        return
+
+    journal.undo(None if args.quiet else rename_message)
+    journal.close()
+
+def resume_op(args):
+    # Replays the given journal, or the newest one left unfinished.
+    journal = RenameJournal(args.JOURNAL) if args.JOURNAL else latest_journal(args.journal_dir, (None,))
+
+    if not journal or not journal.renames:
+        print "No renames to resume!"
+        return
+
+    journal.apply(None if args.quiet else rename_message)
+    journal.close()
+
+def rename_message(filename_old, filename_new):
+    print "{} to {}".format(filename_old, filename_new)
+
+class SizeIndex(object):
+    # Index of files by size, kept in a temporary SQLite database rather
+    # than in memory, so only the files with the same size as another one
+    # are ever held at once, however many files there are.
+
+    def __init__(self):
+        import sqlite3
+        import tempfile
+
+        fd, self.filename = tempfile.mkstemp(prefix = "fck-dedupe-", suffix = ".sqlite")
+        os.close(fd)
+
+        self.db = sqlite3.connect(self.filename)
+        self.db.text_factory = str # Filenames are not always valid UTF-8.
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.execute("CREATE TABLE files (path TEXT, size INTEGER, dev INTEGER, inode INTEGER)")
+
+    def add(self, files):
+        # Indexes (filename, st) tuples, where st may be None.
+        rows = ((filename, st.st_size, st.st_dev, st.st_ino) for filename, st in
+                ((filename, st or os.stat(filename)) for filename, st in files))
+
+        while True:
+            batch = list(itertools.islice(rows, DEDUPE_BATCH_SIZE))
+
+            if not batch:
+                break
+
+            self.db.executemany("INSERT INTO files VALUES (?, ?, ?, ?)", batch)
+
+        self.db.execute("CREATE INDEX files_size ON files (size)")
+        self.db.commit()
+
+    def groups(self, min_size = 1):
+        # Yields (size, [(filename, dev), ...]) tuples for each size shared
+        # by several files, biggest first. Hard links to the same file are
+        # taken only once, as they are not duplicates.
+        sizes = [row[0] for row in self.db.execute("SELECT size FROM files WHERE size >= ? GROUP BY size "
+                                                   "HAVING COUNT(DISTINCT dev || ':' || inode) > 1 ORDER BY size DESC", (min_size,))]
+
+        for size in sizes:
+            seen = set()
+            files = []
+
+            for filename, dev, inode in self.db.execute("SELECT path, dev, inode FROM files WHERE size = ? ORDER BY path", (size,)):
+                if (dev, inode) not in seen:
+                    seen.add((dev, inode))
+                    files.append((filename, dev))
+
+            yield size, files
+
+    def close(self):
+        self.db.close()
+        os.remove(self.filename)
+
+def sample_key(filename, size, sample_size = DEDUPE_SAMPLE_SIZE):
+    # Returns a digest of the first and last sample_size bytes of the file.
+    hasher = hashlib.sha1()
+
+    with open(filename, "rb") as input_file:
+        hasher.update(input_file.read(sample_size))
+
+        if size > sample_size:
+            input_file.seek(max(sample_size, size - sample_size))
+            hasher.update(input_file.read(sample_size))
+
+    return hasher.digest()
+
+def bucket(items, key):
+    # Groups the items by key, keeping the order in which keys first
+    # appear, and returns the groups with more than one item.
+    buckets = collections.OrderedDict()
+
+    for item in items:
+        buckets.setdefault(key(item), []).append(item)
+
+    return [items for items in buckets.values() if len(items) > 1]
+
+def sampled_groups(groups):
+    # Splits the (size, files) groups of same-size files by the contents of
+    # their head and tail, dropping the files left alone.
+    for size, files in groups:
+        keys = {}
+
+        for filename, dev in files:
+            try:
+                keys[filename] = sample_key(filename, size)
+            except EnvironmentError as error:
+                print >> sys.stderr, "{} [Error] {}".format(filename, error.strerror)
+
+        for candidates in bucket([item for item in files if item[0] in keys], lambda item: keys[item[0]]):
+            yield size, candidates
+
+def duplicate_groups(groups, args, cache = None, monitor = None):
+    # Hashes the files of the candidate (size, files) groups in full, and
+    # yields (size, digests, [(filename, dev), ...]) tuples for the files
+    # whose digests are all the same. Files of every group are fed to the
+    # same pool of workers, and results come back in order.
+    members = collections.deque()
+
+    def candidates():
+        for n, (size, files) in enumerate(groups):
+            for filename, dev in files:
+                members.append((n, size, dev))
+                yield filename, None
+
+    def duplicates(size, hashed):
+        for files in bucket(hashed, lambda item: tuple(item[2].values())):
+            yield size, files[0][2], [(filename, dev) for filename, dev, digests in files]
+
+    current, size, hashed = None, None, []
+
+    for filename, digests in hashed_files(candidates(), args.chunk_size, args.jobs, args.per_device, cache, args.mmap, args.algorithms, monitor):
+        n, file_size, dev = members.popleft()
+
+        if n != current:
+            for group in duplicates(size, hashed):
+                yield group
+
+            current, size, hashed = n, file_size, []
+
+        hashed.append((filename, dev, digests))
+
+    for group in duplicates(size, hashed):
+        yield group
+
+def write_dedupe_report(groups, output):
+    for size, digests, files in groups:
+        print >> output, "{} files of {} bytes, {}:".format(len(files), size, ", ".join("{} {}".format(*item) for item in digests.items()))
+
+        for filename, dev in files:
+            print >> output, "    {}".format(filename)
+
+        print >> output
+        yield size, files
+
+def write_dedupe_jsonl(groups, output):
+    import json
+
+    for size, digests, files in groups:
+        record = {"size": size, "digests": digests, "files": [filename.decode("utf-8", "replace") for filename, dev in files]}
+        print >> output, json.dumps(record, sort_keys = True)
+        yield size, files
+
+def write_dedupe_hardlinks(groups, output):
+    # Writes a shell script that replaces every duplicate with a hard link
+    # to the first file of its group. Files on another device than the
+    # first one cannot be linked, and are only listed.
+    import pipes
+
+    print >> output, "#!/bin/sh"
+    print >> output, "set -e"
+
+    for size, digests, files in groups:
+        keep, keep_dev = files[0]
+        print >> output, "\n# {} bytes, {}".format(size, ", ".join("{} {}".format(*item) for item in digests.items()))
+
+        for filename, dev in files[1:]:
+            if dev == keep_dev:
+                print >> output, "ln -f -- {} {}".format(pipes.quote(keep), pipes.quote(filename))
+            else:
+                print >> output, "# On another device: {}".format(filename)
+
+        yield size, files
+
+# Writers of the duplicates found, by format; they pass every group
+# through once it is written.
+DEDUPE_WRITERS = collections.OrderedDict([
+    ("report",    write_dedupe_report),
+    ("jsonl",     write_dedupe_jsonl),
+    ("hardlinks", write_dedupe_hardlinks),
+])
+
+def dedupe_op(args):
+    # Duplicates are found in stages, each reading more of fewer files:
+    # files are grouped by size, then files of the same size by their
+    # head and tail, and only the files still together are hashed in full.
+    index = SizeIndex()
+    cache = open_cache(args)
+    monitor = open_monitor(args)
+    count_groups, count_files, wasted = 0, 0, 0
+
+    try:
+        index.add(discover_files(args))
+        groups = duplicate_groups(sampled_groups(index.groups(args.min_size)), args, cache, monitor)
+
+        for size, files in DEDUPE_WRITERS[args.format](groups, sys.stdout):
+            if monitor: monitor.clear()
+
+            count_groups += 1
+            count_files += len(files)
+            wasted += size * (len(files) - 1)
+
+    finally:
+        if monitor: monitor.close()
+        index.close()
+
+    summary = "{} groups of duplicates, {} files, {} bytes in redundant copies".format(count_groups, count_files, wasted)
+
+    if args.format == "report":
+        print summary if count_groups else "No duplicates found!"
+    else:
+        print >> sys.stderr, summary
+
+def watched_file(filename, args):
+    # Tells whether a file found while watching should be processed.
+    name = os.path.basename(filename)
+
+    if args.exclude and any(fnmatch.fnmatch(name, pattern) for pattern in args.exclude):
+        return False
+
+    if args.include and not any(fnmatch.fnmatch(name, pattern) for pattern in args.include):
+        return False
+
+    return not manifest_algorithm(filename)
+
+def watch_tree(inotify, directory, args):
+    # Watches the directory, and its subdirectories when running
+    # recursively, returning the files already in them that are not
+    # hashed yet.
+    from mediatools.inotify import IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE, IN_ONLYDIR
+
+    inotify.add_watch(directory, IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR)
+    found = []
+
+    for path, is_dir, st in list_dir(directory):
+        if is_dir and args.recursive:
+            found.extend(watch_tree(inotify, path, args))
+
+        elif not is_dir and watched_file(path, args) and not hashed(path, args.algorithms):
+            found.append(path)
+
+    return found
+
+def watch_file(filename, args, cache, renamed):
+    # Checks a hashed file, or renames a new one to include its hash, as
+    # generate does. The new names are added to renamed, so their own
+    # events are ignored.
+    if not os.path.isfile(filename):
+        return
+
+    digests = file_digests(filename, args.algorithms, args.chunk_size, cache, args.mmap)
+
+    if hashed(filename, args.algorithms):
+        print "{} [{}]".format(filename, "OK" if digests_ok(filename, digests) else "Fail")
+        return
+
+    hashed_filename = filename
+    for digest in digests.values():
+        hashed_filename = get_hashed_filename(hashed_filename, digest, args.delimiter)
+
+    if args.dry_run:
+        rename_message(filename, hashed_filename)
+        return
+
+    renamed.add(hashed_filename)
+    rename_file(filename, hashed_filename)
+
+    if not args.quiet: rename_message(filename, hashed_filename)
+
+    if cache: cache.rename(filename, hashed_filename)
+
+def watch_worker(work, args, renamed):
+    # Processes the files queued, until it receives None. Each worker has
+    # its own connection to the cache.
+    cache = open_cache(args)
+
+    while True:
+        filename = work.get()
+
+        if filename is None:
+            break
+
+        try:
+            watch_file(filename, args, cache, renamed)
+        except EnvironmentError as error:
+            print >> sys.stderr, "{} [Error] {}".format(filename, error.strerror)
+
+        # Anything else, such as a locked cache, must not stop the worker
+        # either, or the queue would fill up with nobody to empty it.
+        except Exception as error:
+            print >> sys.stderr, "{} [Error] {}".format(filename, error)
+
+    if cache: cache.close()
+
+def watch_op(args):
+    # Files are processed once they have been closed after being written,
+    # or moved into a watched directory, and nothing else has happened to
+    # them for args.debounce seconds. Then they are queued for the
+    # workers; when the queue is full, events wait in the kernel. If the
+    # kernel has to drop events, the directories are scanned again.
+    import Queue
+    import threading
+    from mediatools.inotify import Inotify, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE, IN_Q_OVERFLOW, IN_ISDIR
+
+    try:
+        inotify = Inotify()
+    except OSError as error:
+        sys.exit("fck watch needs Linux inotify: {}".format(error.strerror))
+
+    work = Queue.Queue(args.queue_size)
+    renamed = set()
+    pending = {} # filename -> time when it may be processed
+    workers = [threading.Thread(target = watch_worker, args = (work, args, renamed)) for n in range(args.jobs)]
+
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    def scan():
+        for directory in args.DIRS:
+            for filename in watch_tree(inotify, directory, args):
+                pending.setdefault(filename, time.time() + args.debounce)
+
+    try:
+        scan()
+
+        # Files already there are only processed with --scan.
+        if not args.scan: pending.clear()
+
+        if not args.quiet: print "Watching {} directories.".format(len(inotify.watches))
+
+        while True:
+            now = time.time()
+
+            for filename in sorted(f for f, due in pending.items() if due <= now):
+                del pending[filename]
+                work.put(filename)
+
+            timeout = max(0, min(pending.values()) - now) if pending else None
+
+            for path, mask in inotify.read_events(timeout):
+                if mask & IN_Q_OVERFLOW:
+                    print >> sys.stderr, "Events were lost, scanning again."
+                    scan()
+
+                elif mask & IN_ISDIR:
+                    if args.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                        for filename in watch_tree(inotify, path, args):
+                            pending[filename] = time.time() + args.debounce
+
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    if path in renamed:
+                        renamed.discard(path)
+
+                    elif watched_file(path, args):
+                        pending[path] = time.time() + args.debounce
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        inotify.close()
+
+        # Let the workers finish the files already queued.
+        for worker in workers:
+            work.put(None)
+
+        for worker in workers:
+            worker.join()
+
+class ScrubState(object):
+    # Where the scrubs left off: when each file was first seen and last
+    # verified, and the result, kept in a SQLite database between runs.
+    # Files whose size or mtime change are due to be verified again.
+
+    def __init__(self, filename):
+        import sqlite3
+
+        directory = os.path.dirname(filename)
+
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.db = sqlite3.connect(filename, timeout = 60)
+        self.db.text_factory = str # Filenames are not always valid UTF-8.
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, added REAL, seen INTEGER, verified REAL, result TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_seen ON files (seen)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, started REAL, finished REAL, bytes INTEGER)")
+        self.db.commit()
+
+    def last_run(self):
+        return self.db.execute("SELECT MAX(finished) FROM runs").fetchone()[0]
+
+    def start_run(self):
+        run = self.db.execute("INSERT INTO runs (started, bytes) VALUES (?, 0)", (time.time(),)).lastrowid
+        self.db.commit()
+
+        return run
+
+    def finish_run(self, run, size):
+        self.db.execute("UPDATE runs SET finished = ?, bytes = ? WHERE id = ?", (time.time(), size, run))
+        self.db.commit()
+
+    def add(self, files, run):
+        # Records the (filename, st) tuples received as seen in this run.
+        now = time.time()
+        files = iter(files)
+
+        while True:
+            batch = [(os.path.abspath(f), st.st_size, st.st_mtime) for f, st in itertools.islice(files, SCRUB_BATCH_SIZE)]
+
+            if not batch:
+                break
+
+            self.db.executemany("UPDATE files SET verified = CASE WHEN size = ? AND mtime = ? THEN verified END, "
+                                "result = CASE WHEN size = ? AND mtime = ? THEN result END, size = ?, mtime = ?, seen = ? WHERE path = ?",
+                                [(size, mtime) * 3 + (run, path) for path, size, mtime in batch])
+            self.db.executemany("INSERT OR IGNORE INTO files (path, size, mtime, added, seen) VALUES (?, ?, ?, ?, ?)",
+                                [(path, size, mtime, now, run) for path, size, mtime in batch])
+            self.db.commit()
+
+    def due(self, run):
+        # Returns the files seen in this run, in the order they are due: a
+        # period after they were last verified, or first seen if they
+        # never were.
+        return self.db.execute("SELECT path, size, added, verified, result FROM files WHERE seen = ? ORDER BY COALESCE(verified, added)",
+                               (run,)).fetchall()
+
+    def pending(self, run, before):
+        # Returns how many files seen in this run were not verified since then.
+        return self.db.execute("SELECT COUNT(*) FROM files WHERE seen = ? AND (verified IS NULL OR verified < ?)", (run, before)).fetchone()[0]
+
+    def record(self, filename, result):
+        self.db.execute("UPDATE files SET verified = ?, result = ? WHERE path = ?", (time.time(), result, os.path.abspath(filename)))
+        self.db.commit()
+
+    def prune(self, run):
+        # Forgets the files, not seen in this run, that no longer exist.
+        paths = [row[0] for row in self.db.execute("SELECT path FROM files WHERE seen != ?", (run,))]
+        deleted = [(path,) for path in paths if not os.path.isfile(path)]
+
+        self.db.executemany("DELETE FROM files WHERE path = ?", deleted)
+        self.db.commit()
+
+        return len(deleted)
+
+    def close(self):
+        self.db.close()
+
+class Throttle(object):
+    # Sleeps as needed to keep the bytes consumed under rate per second,
+    # on average since it was created.
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.start = time.time()
+        self.consumed = 0
+
+    def consume(self, size):
+        self.consumed += size
+        ahead = self.consumed / self.rate - (time.time() - self.start)
+
+        if ahead > 0:
+            time.sleep(ahead)
+
+def lower_io_priority(io_class):
+    # Moves this process to the given I/O scheduling class, so scrubbing
+    # gives way to everything else reading from the disks.
+    import subprocess
+
+    try:
+        with open(os.devnull, "w") as devnull:
+            subprocess.check_call(["ionice", "-c", IONICE_CLASSES[io_class], "-p", str(os.getpid())], stderr = devnull)
+
+    except (OSError, subprocess.CalledProcessError):
+        print >> sys.stderr, "Could not change the I/O priority."
+
+def scrub_op(args):
+    # Verifies a share of the hashed files on each run, so that all of
+    # them are verified once per period: the share of the archive that
+    # corresponds to the time elapsed since the last run (a day's worth
+    # on the first one), plus any file not verified within the period
+    # since it was last verified, or first seen. Files are taken in the
+    # order they are due, and every result is recorded as soon as it is
+    # known, so an interrupted run loses nothing. Only failures not
+    # reported before are shown, unless running verbosely.
+    if args.nice: os.nice(args.nice)
+    if args.ionice != "none": lower_io_priority(args.ionice)
+
+    state = ScrubState(args.state)
+    last_run = state.last_run()
+    run = state.start_run()
+
+    state.add(((f, st or os.stat(f)) for f, st in discover_files(args) if hashed(f, args.algorithms)), run)
+
+    period = float(args.period * DAY)
+    due = state.due(run)
+    start = time.time()
+    quota = sum(size for path, size, added, verified, result in due) * min(1.0, (start - last_run if last_run else DAY) / period)
+    deadline = start + args.max_hours * 3600 if args.max_hours else None
+    throttle = Throttle(args.rate) if args.rate else None
+    count_ok, count_fail, count_new, count_error, verified_bytes = 0, 0, 0, 0, 0
+
+    try:
+        for path, size, added, verified, result in due:
+            # Files never verified are overdue a period after they were
+            # first seen.
+            overdue = (verified if verified is not None else added) + period <= start
+
+            if verified_bytes >= quota and not overdue:
+                continue
+
+            if deadline and time.time() >= deadline:
+                break
+
+            try:
+                digests = file_digests(path, args.algorithms, args.chunk_size, use_mmap = args.mmap, progress = throttle.consume if throttle else None)
+            except EnvironmentError as error:
+                print >> sys.stderr, "{} [Error] {}".format(path, error.strerror)
+                count_error += 1
+                continue
+
+            verified_bytes += size
+
+            if digests_ok(path, digests):
+                count_ok += 1
+                state.record(path, "OK")
+
+                if args.verbose:
+                    print "{} [OK]".format(path)
+
+            else:
+                count_fail += 1
+                state.record(path, "Fail")
+
+                if result != "Fail":
+                    count_new += 1
+                    print "{} [Fail]".format(path)
+
+                elif args.verbose:
+                    print "{} [Fail] (already known)".format(path)
+
+            sys.stdout.flush()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        state.finish_run(run, verified_bytes)
+        pending = state.pending(run, start - period)
+        state.prune(run)
+        state.close()
+
+    print "{} files verified ({} bytes), {} OK, {} Failed ({} new); {} files not verified in the last {:g} days".format(
+        count_ok + count_fail, verified_bytes, count_ok, count_fail, count_new, pending, args.period)
+
+    # Let cron, or whoever runs the scrub, know about any failure.
+    return 1 if count_fail or count_error else 0
+
+def cache_op(args):
+    cache = HashCache(args.cache)
+
+    if args.clear:
+        cache.clear()
+        print "Cache cleared."
+
+    elif args.prune:
+        print "{} entries removed.".format(cache.prune())
+
+    cache.close()
+
+def setup_parser(prog = None):
+    parser = argparse.ArgumentParser(prog = prog)
+    subparsers = parser.add_subparsers(dest = "operation_mode")
+
+    # Check operation
+    parser_check = subparsers.add_parser("check", help = "Performs a check")
+    parser_check.add_argument("-n", "--from-filename", action = "store_true")
+    parser_check.add_argument("-f", "--from-file",     action = "store_true", help = "Check against the manifests given, or found next to the files.")
+    parser_check.add_argument("-v", "--verbose",       action = "store_true", help = "Shows [OK] and [Fail] results.")
+    parser_check.add_argument("-F", "--force",         action = "store_true", help = "Check files with no apparent hash present.")
+    parser_check.add_argument("-c", "--chunk-size",    type = positive_int, default = DEFAULT_FILE_CHUNK_SIZE, help = "Reads the files in chunks of this size in bytes.")
+    parser_check.add_argument("-a", "--algo",          dest = "algorithms", type = algorithms_type, default = DEFAULT_ALGORITHMS, help = "Comma separated hash algorithms: {}.".format(", ".join(HASH_ALGORITHMS)))
+    parser_check.add_argument("-r", "--recursive",     action = "store_true", help = "Processes the files in the directories given, and their subdirectories.")
+    parser_check.add_argument("-i", "--include",       action = "append", metavar = "PATTERN", help = "Only processes files matching this glob pattern; may be repeated.")
+    parser_check.add_argument("-x", "--exclude",       action = "append", metavar = "PATTERN", help = "Skips files and directories matching this glob pattern; may be repeated.")
+    parser_check.add_argument("-m", "--mmap",          action = "store_true", help = "Maps the files into memory instead of reading them, when possible.")
+    parser_check.add_argument("-j", "--jobs",          type = positive_int, default = 1, help = "Hashes this many files at the same time.")
+    parser_check.add_argument("--per-device",          type = positive_int, help = "Reads at most this many files at the same time from the same device.")
+    parser_check.add_argument("-p", "--progress",      action = "store_true", help = "Shows the bytes hashed, throughput, ETA and current file.")
+    parser_check.add_argument("--stats",               choices = ["json"], help = "Writes the size, read and hash times of each file, and their totals.")
+    parser_check.add_argument("--stats-file",          default = "-", help = "File where stats are written (default: standard error).")
+    parser_check.add_argument("--cache",               default = DEFAULT_CACHE_FILE, help = "File where calculated hashes are cached.")
+    parser_check.add_argument("--no-cache",            action = "store_true", help = "Does not use the hash cache.")
+    parser_check.add_argument("--force-rehash",        action = "store_true", help = "Hashes the files again, even if they have not changed since they were cached.")
+    parser_check.add_argument("FILES", nargs = "+")
+    parser_check.set_defaults(func = check_op)
+
+    # Generate operation
+    parser_generate = subparsers.add_parser("generate", help = "Generate hashes and rename files accordingly.")
+    parser_generate.add_argument("-n", "--to-filename", action = "store_true", help = "Renames the files to include their hash (default, unless --to-file).")
+    parser_generate.add_argument("-f", "--to-file",     action = "store_true", help = "Lists the hashes in a manifest in each directory (SFV for crc32).")
+    parser_generate.add_argument("-s", "--skip",        action = "store_true", help = "Does not process files already hashed.")
+    parser_generate.add_argument("-d", "--delimiter",                          help = "A character to separate the hash from the file name.")
+    parser_generate.add_argument("-c", "--chunk-size",  type = positive_int, default = DEFAULT_FILE_CHUNK_SIZE, help = "Reads the files in chunks of this size in bytes.")
+    parser_generate.add_argument("-a", "--algo",        dest = "algorithms", type = algorithms_type, default = DEFAULT_ALGORITHMS, help = "Comma separated hash algorithms: {}.".format(", ".join(HASH_ALGORITHMS)))
+    parser_generate.add_argument("-r", "--recursive",   action = "store_true", help = "Processes the files in the directories given, and their subdirectories.")
+    parser_generate.add_argument("-i", "--include",     action = "append", metavar = "PATTERN", help = "Only processes files matching this glob pattern; may be repeated.")
+    parser_generate.add_argument("-x", "--exclude",     action = "append", metavar = "PATTERN", help = "Skips files and directories matching this glob pattern; may be repeated.")
+    parser_generate.add_argument("-m", "--mmap",        action = "store_true", help = "Maps the files into memory instead of reading them, when possible.")
+    parser_generate.add_argument("-j", "--jobs",        type = positive_int, default = 1, help = "Hashes this many files at the same time.")
+    parser_generate.add_argument("--per-device",        type = positive_int, help = "Reads at most this many files at the same time from the same device.")
+    parser_generate.add_argument("-p", "--progress",    action = "store_true", help = "Shows the bytes hashed, throughput, ETA and current file.")
+    parser_generate.add_argument("--stats",             choices = ["json"], help = "Writes the size, read and hash times of each file, and their totals.")
+    parser_generate.add_argument("--stats-file",        default = "-", help = "File where stats are written (default: standard error).")
+    parser_generate.add_argument("--cache",             default = DEFAULT_CACHE_FILE, help = "File where calculated hashes are cached.")
+    parser_generate.add_argument("--no-cache",          action = "store_true", help = "Does not use the hash cache.")
+    parser_generate.add_argument("--force-rehash",      action = "store_true", help = "Hashes the files again, even if they have not changed since they were cached.")
+    parser_generate.add_argument("--dry-run",           action = "store_true", help = "Shows the renames, without doing them.")
+    parser_generate.add_argument("--journal-dir",       default = DEFAULT_JOURNAL_DIR, help = "Directory where the journals of renames are kept.")
+    
+    parser_generate_yes_quiet_group = parser_generate.add_mutually_exclusive_group()
+    parser_generate_yes_quiet_group.add_argument("-y", "--yes",         action = "store_true")
+    parser_generate_yes_quiet_group.add_argument("-q", "--quiet",       action = "store_true", help = "Does not show anything. Implies --yes.")
+    
+    parser_generate.add_argument("FILES", nargs = "+")
+    parser_generate.set_defaults(func = generate_op)
+
+    # Undo and resume operations
+    parser_undo = subparsers.add_parser("undo", help = "Reverts the renames of a generate operation.")
+    parser_undo.add_argument("-q", "--quiet",     action = "store_true", help = "Does not show anything.")
+    parser_undo.add_argument("--journal-dir",     default = DEFAULT_JOURNAL_DIR, help = "Directory where the journals of renames are kept.")
+    parser_undo.add_argument("JOURNAL", nargs = "?", help = "Journal to revert (default: the newest one).")
+    parser_undo.set_defaults(func = undo_op)
+
+    parser_resume = subparsers.add_parser("resume", help = "Finishes the renames of an interrupted generate operation.")
+    parser_resume.add_argument("-q", "--quiet",   action = "store_true", help = "Does not show anything.")
+    parser_resume.add_argument("--journal-dir",   default = DEFAULT_JOURNAL_DIR, help = "Directory where the journals of renames are kept.")
+    parser_resume.add_argument("JOURNAL", nargs = "?", help = "Journal to replay (default: the newest unfinished one).")
+    parser_resume.set_defaults(func = resume_op)
+
+    # Dedupe operation
+    parser_dedupe = subparsers.add_parser("dedupe", help = "Finds duplicate files.")
+    parser_dedupe.add_argument("-f", "--format",      choices = list(DEDUPE_WRITERS), default = "report", help = "Writes a report, JSON Lines, or a shell script replacing duplicates with hard links.")
+    parser_dedupe.add_argument("--min-size",          type = int, default = 1, help = "Ignores files smaller than this size in bytes.")
+    parser_dedupe.add_argument("-c", "--chunk-size",  type = positive_int, default = DEFAULT_FILE_CHUNK_SIZE, help = "Reads the files in chunks of this size in bytes.")
+    parser_dedupe.add_argument("-a", "--algo",        dest = "algorithms", type = algorithms_type, default = DEDUPE_ALGORITHMS, help = "Comma separated hash algorithms: {} (default: {}).".format(", ".join(HASH_ALGORITHMS), ",".join(DEDUPE_ALGORITHMS)))
+    parser_dedupe.add_argument("-r", "--recursive",   action = "store_true", help = "Processes the files in the directories given, and their subdirectories.")
+    parser_dedupe.add_argument("-i", "--include",     action = "append", metavar = "PATTERN", help = "Only processes files matching this glob pattern; may be repeated.")
+    parser_dedupe.add_argument("-x", "--exclude",     action = "append", metavar = "PATTERN", help = "Skips files and directories matching this glob pattern; may be repeated.")
+    parser_dedupe.add_argument("-m", "--mmap",        action = "store_true", help = "Maps the files into memory instead of reading them, when possible.")
+    parser_dedupe.add_argument("-j", "--jobs",        type = positive_int, default = 1, help = "Hashes this many files at the same time.")
+    parser_dedupe.add_argument("--per-device",        type = positive_int, help = "Reads at most this many files at the same time from the same device.")
+    parser_dedupe.add_argument("-p", "--progress",    action = "store_true", help = "Shows the bytes hashed, throughput, ETA and current file.")
+    parser_dedupe.add_argument("--stats",             choices = ["json"], help = "Writes the size, read and hash times of each file, and their totals.")
+    parser_dedupe.add_argument("--stats-file",        default = "-", help = "File where stats are written (default: standard error).")
+    parser_dedupe.add_argument("--cache",             default = DEFAULT_CACHE_FILE, help = "File where calculated hashes are cached.")
+    parser_dedupe.add_argument("--no-cache",          action = "store_true", help = "Does not use the hash cache.")
+    parser_dedupe.add_argument("--force-rehash",      action = "store_true", help = "Hashes the files again, even if they have not changed since they were cached.")
+    parser_dedupe.add_argument("FILES", nargs = "+")
+    parser_dedupe.set_defaults(func = dedupe_op)
+
+    # Watch operation
+    parser_watch = subparsers.add_parser("watch", help = "Hashes files as they are written into the given directories.")
+    parser_watch.add_argument("-d", "--delimiter",   default = "_", help = "A character to separate the hash from the file name.")
+    parser_watch.add_argument("-c", "--chunk-size",  type = positive_int, default = DEFAULT_FILE_CHUNK_SIZE, help = "Reads the files in chunks of this size in bytes.")
+    parser_watch.add_argument("-a", "--algo",        dest = "algorithms", type = algorithms_type, default = DEFAULT_ALGORITHMS, help = "Comma separated hash algorithms: {}.".format(", ".join(HASH_ALGORITHMS)))
+    parser_watch.add_argument("-r", "--recursive",   action = "store_true", help = "Watches the subdirectories too, including new ones.")
+    parser_watch.add_argument("-i", "--include",     action = "append", metavar = "PATTERN", help = "Only processes files matching this glob pattern; may be repeated.")
+    parser_watch.add_argument("-x", "--exclude",     action = "append", metavar = "PATTERN", help = "Skips files matching this glob pattern, e.g. '*.part'; may be repeated.")
+    parser_watch.add_argument("-m", "--mmap",        action = "store_true", help = "Maps the files into memory instead of reading them, when possible.")
+    parser_watch.add_argument("-j", "--jobs",        type = positive_int, default = 1, help = "Hashes this many files at the same time.")
+    parser_watch.add_argument("--debounce",          type = float, default = 2.0, help = "Seconds a file must be left alone before it is hashed.")
+    parser_watch.add_argument("--queue-size",        type = positive_int, default = 100, help = "Files waiting to be hashed at most; further events wait in the kernel.")
+    parser_watch.add_argument("--scan",              action = "store_true", help = "Also hashes the files not hashed yet that are already in the directories.")
+    parser_watch.add_argument("--dry-run",           action = "store_true", help = "Shows the renames, without doing them.")
+    parser_watch.add_argument("--cache",             default = DEFAULT_CACHE_FILE, help = "File where calculated hashes are cached.")
+    parser_watch.add_argument("--no-cache",          action = "store_true", help = "Does not use the hash cache.")
+    parser_watch.add_argument("-q", "--quiet",       action = "store_true", help = "Does not show the renames.")
+    parser_watch.add_argument("DIRS", nargs = "+")
+    parser_watch.set_defaults(func = watch_op)
+
+    # Scrub operation
+    parser_scrub = subparsers.add_parser("scrub", help = "Verifies the hashed files a share at a time, e.g. nightly, to find bit rot.")
+    parser_scrub.add_argument("-v", "--verbose",     action = "store_true", help = "Shows [OK] results, and failures already reported.")
+    parser_scrub.add_argument("-c", "--chunk-size",  type = positive_int, default = DEFAULT_FILE_CHUNK_SIZE, help = "Reads the files in chunks of this size in bytes.")
+    parser_scrub.add_argument("-a", "--algo",        dest = "algorithms", type = algorithms_type, default = DEFAULT_ALGORITHMS, help = "Comma separated hash algorithms: {}.".format(", ".join(HASH_ALGORITHMS)))
+    parser_scrub.add_argument("-r", "--recursive",   action = "store_true", help = "Processes the files in the directories given, and their subdirectories.")
+    parser_scrub.add_argument("-i", "--include",     action = "append", metavar = "PATTERN", help = "Only processes files matching this glob pattern; may be repeated.")
+    parser_scrub.add_argument("-x", "--exclude",     action = "append", metavar = "PATTERN", help = "Skips files and directories matching this glob pattern; may be repeated.")
+    parser_scrub.add_argument("-m", "--mmap",        action = "store_true", help = "Maps the files into memory instead of reading them, when possible.")
+    parser_scrub.add_argument("--period",            type = float, default = DEFAULT_SCRUB_PERIOD, help = "Days in which every file is verified once.")
+    parser_scrub.add_argument("--rate",              type = size_type, help = "Reads at most this many bytes per second, e.g. 20M.")
+    parser_scrub.add_argument("--max-hours",         type = float, help = "Stops after this many hours, to go on in the next run.")
+    parser_scrub.add_argument("--nice",              type = int, default = 10, help = "Lowers the CPU priority by this much.")
+    parser_scrub.add_argument("--ionice",            choices = ["idle", "best-effort", "none"], default = "idle", help = "I/O scheduling class, with ionice.")
+    parser_scrub.add_argument("--state",             default = DEFAULT_SCRUB_STATE, help = "File where the scrub progress is kept.")
+    parser_scrub.add_argument("FILES", nargs = "+")
+    parser_scrub.set_defaults(func = scrub_op)
+
+    # Cache operation
+    parser_cache = subparsers.add_parser("cache", help = "Maintains the hash cache.")
+    parser_cache.add_argument("--cache", default = DEFAULT_CACHE_FILE, help = "File where calculated hashes are cached.")
+
+    parser_cache_op_group = parser_cache.add_mutually_exclusive_group(required = True)
+    parser_cache_op_group.add_argument("--prune", action = "store_true", help = "Removes the entries of files that no longer exist.")
+    parser_cache_op_group.add_argument("--clear", action = "store_true", help = "Removes every entry.")
+    parser_cache.set_defaults(func = cache_op)
+
+    # Update operation
+    # --update-all
+    # --update-some
+
+    return parser
+
+def main(argv = None, prog = None):
+    if DEBUG: print sys.argv
+
+    parser = setup_parser(prog)
+    args = parser.parse_args(argv)
+
+    return args.func(args) # Executes the default function associated to the chosen operation.
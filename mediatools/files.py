@@ -0,0 +1,142 @@
+
+#
+# Copyright 2013 Guillermo Barriga Placencia <gbarrigap@yahoo.es>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# 
+
+
+#
+# Finding, filtering and sorting files.
+#
+
+import os
+import re
+import stat
+import fnmatch
+import heapq
+
+NUMBERS_REGEX = re.compile('([0-9]+)')
+
+def load_scandir():
+    # Returns the scandir function, or None if it is not available. It is
+    # imported on first use, as the scandir module for Python 2 takes
+    # longer to load than many runs take.
+    if load_scandir.function is False:
+        try:
+            from os import scandir
+        except ImportError:
+            try:
+                from scandir import scandir # Python 2: pip install scandir
+            except ImportError:
+                scandir = None
+
+        load_scandir.function = scandir
+
+    return load_scandir.function
+
+load_scandir.function = False
+
+def iter_dir(directory):
+    # Lazily yields the (path, is_dir, st) entries of the received
+    # directory, where st is the stat of files if it is already known.
+    scandir = load_scandir()
+
+    if scandir:
+        for entry in scandir(directory):
+            if entry.is_dir(follow_symlinks = False):
+                yield entry.path, True, None
+
+            elif entry.is_file():
+                yield entry.path, False, None
+
+        return
+
+    # Without scandir, every entry must be stat'ed to tell its type.
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        st = os.lstat(path)
+
+        if stat.S_ISLNK(st.st_mode):
+            st = os.stat(path) if os.path.exists(path) else st
+
+            if stat.S_ISDIR(st.st_mode):
+                continue
+
+        if stat.S_ISDIR(st.st_mode) or stat.S_ISREG(st.st_mode):
+            yield path, stat.S_ISDIR(st.st_mode), st
+
+def list_dir(directory):
+    # Returns the entries of iter_dir at once, so files renamed while the
+    # directory is being processed are not seen twice.
+    return list(iter_dir(directory))
+
+def walk_files(directory, include = None, exclude = None, recursive = True, sort = True):
+    # Lazily yields (filename, st) tuples for the regular files under the
+    # received directory; symbolic links to directories are not followed.
+    # Names matching any exclude pattern are skipped, directories
+    # included; when include patterns are given, only files matching one
+    # of them are yielded.
+    #
+    # Each directory is listed and sorted before its files are yielded,
+    # unless sort is False: then files are yielded as they are listed, in
+    # no particular order, and may be seen twice if renamed meanwhile.
+    directories = [directory]
+
+    while directories:
+        subdirectories = []
+        entries = sorted(list_dir(directories.pop())) if sort else iter_dir(directories.pop())
+
+        for path, is_dir, st in entries:
+            name = os.path.basename(path)
+
+            if exclude and any(fnmatch.fnmatch(name, pattern) for pattern in exclude):
+                continue
+
+            if is_dir:
+                if recursive: subdirectories.append(path)
+
+            elif not include or any(fnmatch.fnmatch(name, pattern) for pattern in include):
+                yield path, st
+
+        # Walk subdirectories in order, depth first.
+        directories.extend(reversed(subdirectories))
+
+def has_extension(filename, extensions):
+    # Tells whether the filename ends with any of the extensions, such as
+    # ".mkv", regardless of case.
+    return os.path.splitext(filename)[1].lower() in extensions
+
+def filter_by_extension(filenames, extensions):
+    for filename in filenames:
+        if has_extension(filename, extensions):
+            yield filename
+
+def tryint(s):
+    try:
+        return int(s)
+    except ValueError:
+        return s
+
+def alphanum_key(s):
+    # Turn a string into a list of string and number chunks. "z23a" -> ["z", 23, "a"]
+    return [ tryint(c) for c in NUMBERS_REGEX.split(s) ]
+
+def sort_nicely(l, limit = 0):
+    # Sort the given list in the way that humans expect. With a limit, only
+    # the first limit items are returned, without sorting the whole list.
+    if 0 < limit < len(l):
+        return heapq.nsmallest(limit, l, key = alphanum_key)
+
+    return sorted(l, key = alphanum_key)
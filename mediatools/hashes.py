@@ -0,0 +1,53 @@
+
+#
+# Copyright 2013 Guillermo Barriga Placencia <gbarrigap@yahoo.es>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# 
+
+
+#
+# CRC32 hashes, and the names of the files tagged with them, such as
+# "video_[1A2B3C4D].mkv".
+#
+
+import os
+import binascii # binascii.crc32()
+
+def format_hash(cksum_dec):
+    return '%08X' % (cksum_dec & 0xffffffff)
+
+class CRC32(object):
+    # Wraps binascii.crc32 with the same interface as the hashlib objects.
+    name = "crc32"
+    digest_size = 4
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = binascii.crc32(data, self.value)
+
+    def hexdigest(self):
+        return format_hash(self.value)
+
+def get_hashed_filename(filename, cksum, delimiter):
+    # Only the name of the file is tagged, not its directory.
+    directory, filename = os.path.split(filename)
+    filename_parts = filename.split('.')
+    filename_parts_count = len(filename_parts)
+    filename_parts[filename_parts_count - 2] += delimiter + "[" + str.upper(cksum) + "]" # + filename_parts[filename_parts_count - 1]
+    filename_new = '.'.join(filename_parts)
+
+    return os.path.join(directory, filename_new)
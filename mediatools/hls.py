@@ -0,0 +1,153 @@
+
+#
+# Copyright 2013 Guillermo Barriga Placencia <gbarrigap@yahoo.es>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# 
+
+
+#
+# Downloads the segments of HLS streams (and any other file over HTTP),
+# for vidcat to concatenate them as they arrive, without saving them as
+# separate files.
+#
+# Segments are downloaded by a bounded pool of threads (this code runs on
+# Python 2, without asyncio), each keeping a connection open per host, so
+# consecutive segments reuse it. Failed requests are retried, waiting
+# longer after each attempt.
+#
+
+import os
+import re
+import time
+import socket
+import threading
+import httplib
+import urlparse
+
+USER_AGENT = "mediatools"
+TIMEOUT = 30 # Seconds without an answer before a request fails.
+RETRY_DELAY = 0.5 # Seconds before the first retry, doubled after each one.
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+BANDWIDTH_REGEX = re.compile(r'[:,]BANDWIDTH=([0-9]+)')
+
+class FetchError(IOError):
+    pass
+
+class Fetcher(object):
+    # Downloads URLs over HTTP or HTTPS. Connections are kept per thread,
+    # as httplib connections may not be shared, and per host.
+
+    def __init__(self, retries = 3, timeout = TIMEOUT):
+        self.retries = retries
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self, scheme, netloc):
+        connections = self.local.__dict__.setdefault("connections", {})
+
+        if (scheme, netloc) not in connections:
+            connection_class = httplib.HTTPSConnection if scheme == "https" else httplib.HTTPConnection
+            connections[(scheme, netloc)] = connection_class(netloc, timeout = self.timeout)
+
+        return connections[(scheme, netloc)]
+
+    def drop(self, scheme, netloc):
+        connection = self.local.__dict__.get("connections", {}).pop((scheme, netloc), None)
+
+        if connection:
+            connection.close()
+
+    def request(self, url):
+        # Returns the response to a GET of the URL and its body, retrying
+        # after connection errors, server errors and throttling.
+        parts = urlparse.urlsplit(url)
+        path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        failure = None
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+
+            try:
+                connection = self.connection(parts.scheme, parts.netloc)
+                connection.request("GET", path, headers = {"User-Agent": USER_AGENT})
+                response = connection.getresponse()
+                body = response.read()
+
+            except (httplib.HTTPException, socket.error) as error:
+                # The server may have closed a connection kept open.
+                self.drop(parts.scheme, parts.netloc)
+                failure = str(error) or error.__class__.__name__
+                continue
+
+            if response.status >= 500 or response.status in (408, 429):
+                failure = "HTTP {} {}".format(response.status, response.reason)
+                continue
+
+            return response, body
+
+        raise FetchError("{}: {}".format(url, failure))
+
+    def fetch(self, url):
+        # Returns the contents of the URL, following redirections.
+        for redirect in range(MAX_REDIRECTS + 1):
+            response, body = self.request(url)
+            location = response.getheader("Location")
+
+            if response.status in REDIRECT_STATUSES and location:
+                url = urlparse.urljoin(url, location)
+                continue
+
+            if response.status != 200:
+                raise FetchError("{}: HTTP {} {}".format(url, response.status, response.reason))
+
+            return body
+
+        raise FetchError("{}: too many redirections".format(url))
+
+def segment_name(url):
+    # Returns the file name of the URL, e.g. "media_0.ts" for
+    # "http://host/path/media_0.ts?token=...".
+    return os.path.basename(urlparse.urlsplit(url).path)
+
+def is_playlist(url):
+    return urlparse.urlsplit(url).path.endswith((".m3u8", ".m3u"))
+
+def playlist_segments(fetcher, url):
+    # Returns the URLs of the segments of an HLS playlist, in the order they
+    # are played. Master playlists list variants of the same stream
+    # instead, in which case the one with the highest bandwidth is taken.
+    segments, variants = [], []
+    bandwidth = None
+
+    for line in fetcher.fetch(url).splitlines():
+        line = line.strip()
+
+        if line.startswith("#EXT-X-STREAM-INF"):
+            match = BANDWIDTH_REGEX.search(line)
+            bandwidth = int(match.group(1)) if match else 0
+
+        elif line and not line.startswith("#"):
+            if bandwidth is None:
+                segments.append(urlparse.urljoin(url, line))
+            else:
+                variants.append((bandwidth, urlparse.urljoin(url, line)))
+                bandwidth = None
+
+    if variants:
+        return playlist_segments(fetcher, max(variants)[1])
+
+    return segments
@@ -0,0 +1,95 @@
+
+#
+# Copyright 2013 Guillermo Barriga Placencia <gbarrigap@yahoo.es>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# 
+
+
+#
+# Minimal interface to Linux inotify, through the C library, to learn
+# about changes in directories without polling them.
+#
+
+import os
+import errno
+import struct
+import select
+import ctypes
+
+from mediatools.libc import libc_function
+
+# Events, from <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+IN_ISDIR       = 0x40000000
+IN_CLOEXEC     = 02000000
+
+EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, length of the name.
+READ_SIZE = 2**16
+
+inotify_init1 = libc_function("inotify_init1", ctypes.c_int, [ctypes.c_int])
+inotify_add_watch = libc_function("inotify_add_watch", ctypes.c_int, [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32])
+
+class Inotify(object):
+    # A set of watched directories, and the events that happen in them.
+
+    def __init__(self):
+        if not (inotify_init1 and inotify_add_watch):
+            raise OSError(errno.ENOSYS, "inotify is not available on this system")
+
+        self.fd = inotify_init1(IN_CLOEXEC)
+        self.watches = {} # wd -> path
+
+    def add_watch(self, path, mask):
+        wd = inotify_add_watch(self.fd, path, mask)
+        self.watches[wd] = path
+
+        return wd
+
+    def read_events(self, timeout = None):
+        # Waits up to timeout seconds (forever if None) for events, and
+        # returns them as (path, mask) tuples, where path is that of the
+        # file the event happened to. Lost events are reported once as
+        # (None, IN_Q_OVERFLOW).
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+
+        data = os.read(self.fd, READ_SIZE)
+        events = []
+        offset = 0
+
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip("\0")
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+
+            elif mask & IN_IGNORED:
+                # The directory is gone, or no longer watched.
+                self.watches.pop(wd, None)
+
+            elif wd in self.watches:
+                events.append((os.path.join(self.watches[wd], name) if name else self.watches[wd], mask))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,47 @@
+
+#
+# Copyright 2013 Guillermo Barriga Placencia <gbarrigap@yahoo.es>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# 
+
+
+#
+# Access to functions of the C library that Python 2 does not expose.
+#
+
+import os
+import ctypes
+
+def libc_function(name, restype, argtypes):
+    # Returns a function from the C library that raises OSError on failure,
+    # or None if it is not available.
+    try:
+        function = getattr(ctypes.CDLL(None, use_errno = True), name)
+    except (OSError, AttributeError):
+        return None
+
+    function.restype = restype
+    function.argtypes = argtypes
+
+    def call(*args):
+        result = function(*args)
+
+        if result < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        return result
+
+    return call
@@ -0,0 +1,572 @@
+#
+# Copyright 2013 Guillermo Barriga Placencia <gbarrigap@yahoo.es>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# 
+
+import sys
+import argparse
+import os
+import re
+import subprocess # Replaces os.command
+import glob
+import multiprocessing
+import collections
+import itertools
+import csv
+import json
+import sqlite3
+import xml.etree.ElementTree
+import xml.sax.saxutils
+from multiprocessing.pool import ThreadPool
+
+from mediatools.arguments import positive_int
+from mediatools.files import walk_files, has_extension
+
+# Init some global variables.
+DEBUG = True
+MEDIAINFO = ["mediainfo", "--Output=XML"]
+DEFAULT_EXTENSIONS = "mkv,mp4,m4v,mov,ts,m2ts,mts,avi,webm,mpg,mpeg,wmv,flv"
+DEFAULT_BATCH_SIZE = 100 # Files per mediainfo process, so the first ones start early.
+SNIFF_SIZE = 512 # Bytes read from the start of files to tell their type.
+ARG_MAX_MARGIN = 4096 # Bytes of the argument space left unused, just in case.
+ROOT_REGEX = re.compile(r'^\s*(<\?xml[^>]*\?>)?\s*(<(\w+)\b[^>]*>)(.*)</\3>\s*$', re.S)
+FILE_REGEX = re.compile(r'<(File|media)\b[^>]*>.*?</\1>', re.S) # <File> up to 0.7, <media> since.
+NAME_REGEX = re.compile(r'^<media\b[^>]*\bref="([^"]*)"|<Complete_name>(.*?)</Complete_name>', re.S)
+CRC32_REGEX = re.compile(r'[\[(]([0-9A-Fa-f]{8})[\])]') # As in "name [1A2B3C4D].mkv".
+NUMBER_REGEX = re.compile(r'^([0-9][0-9 ]*(?:\.[0-9]+)?)\s*([A-Za-z/]*)')
+DURATION_REGEX = re.compile(r'([0-9.]+)\s*(h|mn|min|ms|s)\b')
+DURATION_UNITS = {"h": 3600, "mn": 60, "min": 60, "s": 1, "ms": 0.001}
+BITRATE_UNITS = {"": 1, "bps": 1, "b/s": 1, "kbps": 10**3, "kb/s": 10**3, "mbps": 10**6, "mb/s": 10**6, "gbps": 10**9, "gb/s": 10**9}
+INVENTORY_FIELDS = ("path", "size", "duration", "container", "video_codec", "audio_codecs", "width", "height", "bitrate", "crc32")
+SQLITE_BATCH_SIZE = 1000 # Records inserted at once.
+DEFAULT_CACHE_FILE = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "media2inventory", "inventory.sqlite")
+
+def extensions_type(value):
+    return set("." + extension.strip(".").lower() for extension in value.split(",") if extension.strip("."))
+
+# Functions telling whether the first bytes of a file are those of a media
+# container, by name; more can be registered here.
+def is_matroska(header):
+    return header.startswith("\x1a\x45\xdf\xa3") # EBML, also WebM.
+
+def is_iso_media(header):
+    return header[4:8] == "ftyp" # MP4, MOV, 3GP...
+
+def is_mpeg_ts(header):
+    # Sync bytes every 188 bytes, or 192 in M2TS, which prefixes packets
+    # with a 4 bytes timecode.
+    return (len(header) > 376 and header[0] == header[188] == header[376] == "\x47") or \
+           (len(header) > 388 and header[4] == header[196] == header[388] == "\x47")
+
+def is_mpeg_ps(header):
+    return header.startswith("\x00\x00\x01\xba")
+
+def is_avi(header):
+    return header.startswith("RIFF") and header[8:12] == "AVI "
+
+def is_asf(header):
+    return header.startswith("\x30\x26\xb2\x75\x8e\x66\xcf\x11") # WMV, WMA.
+
+def is_flv(header):
+    return header.startswith("FLV\x01")
+
+MEDIA_SIGNATURES = collections.OrderedDict([
+    ("matroska", is_matroska),
+    ("iso-media", is_iso_media),
+    ("mpeg-ts", is_mpeg_ts),
+    ("mpeg-ps", is_mpeg_ps),
+    ("avi", is_avi),
+    ("asf", is_asf),
+    ("flv", is_flv),
+])
+
+def sniff_media_type(filename):
+    # Returns the name of the media container of the file, judging by its
+    # contents, or None.
+    try:
+        with open(filename, "rb") as input_file:
+            header = input_file.read(SNIFF_SIZE)
+    except EnvironmentError:
+        return None
+
+    for name, signature in MEDIA_SIGNATURES.items():
+        if signature(header):
+            return name
+
+    return None
+
+def video_file(f, extensions, sniff = False):
+    # Tells whether the file is a video, by its extension or, when
+    # sniffing, by its contents.
+    return has_extension(f, extensions) or (sniff and sniff_media_type(f) is not None)
+
+def video_files(args):
+    # Yields the video files in the received directories, as they are
+    # listed, and the received files themselves.
+    for path in args.FILES:
+        if os.path.isdir(path):
+            for f, st in walk_files(path, recursive = args.recursive, sort = False):
+                if video_file(f, args.extensions, args.sniff):
+                    yield f
+
+        elif os.path.isfile(path):
+            yield path
+
+def argument_space():
+    # Returns how many bytes of arguments a new process may receive, which
+    # the environment also takes from.
+    environment = sum(len(key) + len(value) + 2 + 8 for key, value in os.environ.items())
+
+    return os.sysconf("SC_ARG_MAX") - environment - ARG_MAX_MARGIN
+
+def batches(filenames, max_length, max_files):
+    # Splits the filenames into lists whose command lines fit in
+    # max_length bytes, counting each argument with its terminating null
+    # byte and its pointer, and hold max_files files at most.
+    batch, length = [], sum(len(arg) + 1 + 8 for arg in MEDIAINFO)
+
+    for filename in filenames:
+        size = len(filename) + 1 + 8
+
+        if batch and (length + size > max_length or len(batch) == max_files):
+            yield batch
+            batch, length = [], sum(len(arg) + 1 + 8 for arg in MEDIAINFO)
+
+        batch.append(filename)
+        length += size
+
+    if batch:
+        yield batch
+
+class ProbeCache(object):
+    # Persistent store of the mediainfo output of each file, kept in a
+    # SQLite database. An entry is only used while the size and mtime of
+    # its file are the same as when it was probed. The root element of
+    # the last mediainfo output is kept too, to rebuild the inventory
+    # without running mediainfo at all.
+
+    def __init__(self, filename):
+        directory = os.path.dirname(filename)
+
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.db = sqlite3.connect(filename, timeout = 60)
+        self.db.text_factory = str # Filenames are not always valid UTF-8.
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS probes (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, xml TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS header (id INTEGER PRIMARY KEY CHECK (id = 0), declaration TEXT, start_tag TEXT, root TEXT)")
+        self.db.commit()
+
+    def lookup(self, filename, key):
+        # Returns the cached output for the file, or None if it must be
+        # probed again.
+        row = self.db.execute("SELECT size, mtime, xml FROM probes WHERE path = ?", (os.path.abspath(filename),)).fetchone()
+
+        return row[2] if row and tuple(row[:2]) == key else None
+
+    def store(self, entries):
+        # Stores (filename, key, xml) entries.
+        self.db.executemany("INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?)",
+                            [(os.path.abspath(filename),) + key + (xml,) for filename, key, xml in entries])
+        self.db.commit()
+
+    def get_header(self):
+        return self.db.execute("SELECT declaration, start_tag, root FROM header").fetchone()
+
+    def set_header(self, declaration, start_tag, root):
+        self.db.execute("INSERT OR REPLACE INTO header VALUES (0, ?, ?, ?)", (declaration, start_tag, root))
+        self.db.commit()
+
+    def prune(self):
+        # Evicts the entries of files that no longer exist.
+        paths = [row[0] for row in self.db.execute("SELECT path FROM probes")]
+        deleted = [(path,) for path in paths if not os.path.isfile(path)]
+
+        self.db.executemany("DELETE FROM probes WHERE path = ?", deleted)
+        self.db.commit()
+
+        return len(deleted)
+
+    def close(self):
+        self.db.close()
+
+def file_key(filename):
+    st = os.stat(filename)
+
+    return st.st_size, st.st_mtime
+
+def split_files(batch, contents):
+    # Returns (filename, xml) tuples for the files of the batch found in the
+    # contents of a mediainfo output. mediainfo lists the files in the
+    # order it receives them, but skips those it cannot open, in which case
+    # they are matched by name. Files not found get an empty fragment, so
+    # they are not probed again until they change.
+    fragments = [match.group(0) for match in FILE_REGEX.finditer(contents)]
+
+    if len(fragments) == len(batch):
+        return zip(batch, fragments)
+
+    names = {}
+
+    for fragment in fragments:
+        match = NAME_REGEX.search(fragment)
+
+        if match:
+            name = xml.sax.saxutils.unescape(match.group(1) or match.group(2), {"&quot;": '"', "&apos;": "'"})
+            names[os.path.abspath(name)] = fragment
+
+    return [(filename, names.get(os.path.abspath(filename), "")) for filename in batch]
+
+def run_mediainfo(batch):
+    # Returns the XML document mediainfo outputs for the batch of files, or
+    # None if it failed.
+    try:
+        return subprocess.check_output(MEDIAINFO + batch)
+
+    except subprocess.CalledProcessError as error:
+        print >> sys.stderr, "mediainfo failed ({}) on {} files, from {} to {}".format(
+            error.returncode, len(batch), batch[0], batch[-1])
+        return None
+
+def store_batch(cache, keys, batch, document):
+    # Stores the output of mediainfo for the batch of files in the cache.
+    match = ROOT_REGEX.match(document or "")
+
+    if not match:
+        if document: print >> sys.stderr, "Ignoring a mediainfo output that is not XML"
+        return
+
+    cache.set_header(*match.group(1, 2, 3))
+    cache.store((filename, keys.pop(filename), fragment) for filename, fragment in split_files(batch, match.group(4)))
+
+def probe_files(filenames, args, cache):
+    # Probes the files missing from the cache, or changed since they were
+    # cached, as they are received, storing the results as each batch
+    # finishes; at most two batches per job are in flight. Returns the
+    # list of all the files received, and the number of them probed.
+    seen = []
+    keys = {}
+
+    def pending():
+        for filename in filenames:
+            seen.append(filename)
+            key = file_key(filename)
+
+            if cache.lookup(filename, key) is None:
+                keys[filename] = key
+                yield filename
+
+    pool = ThreadPool(args.jobs)
+    in_flight = collections.deque()
+    probed = 0
+
+    try:
+        for batch in batches(pending(), argument_space(), args.batch_size):
+            in_flight.append((batch, pool.apply_async(run_mediainfo, (batch,))))
+            probed += len(batch)
+
+            if len(in_flight) >= 2 * args.jobs:
+                batch, result = in_flight.popleft()
+                store_batch(cache, keys, batch, result.get())
+
+        while in_flight:
+            batch, result = in_flight.popleft()
+            store_batch(cache, keys, batch, result.get())
+
+    finally:
+        pool.terminate()
+
+    return seen, probed
+
+def write_cached_inventory(filenames, cache, output):
+    # Writes the inventory of the files from the cache, in order, leaving
+    # out those mediainfo could not probe.
+    header = cache.get_header()
+
+    if header is None:
+        return
+
+    declaration, start_tag, root = header
+    if declaration: output.write(declaration + "\n")
+    output.write(start_tag + "\n")
+
+    for filename in filenames:
+        fragment = cache.lookup(filename, file_key(filename))
+        if fragment: output.write(fragment + "\n")
+
+    output.write("</{}>\n".format(root))
+
+def write_inventory(documents, output):
+    # Writes the documents, one per batch, as a single one: the XML
+    # declaration and root element of the first one, followed by the
+    # contents of the root element of each of them.
+    root = None
+
+    for document in documents:
+        match = ROOT_REGEX.match(document or "")
+
+        if not match:
+            if document: print >> sys.stderr, "Ignoring a mediainfo output that is not XML"
+            continue
+
+        if root is None:
+            declaration, start_tag, root = match.group(1, 2, 3)
+            if declaration: output.write(declaration + "\n")
+            output.write(start_tag + "\n")
+
+        contents = match.group(4).strip("\n")
+        if contents: output.write(contents + "\n")
+        output.flush()
+
+    if root is not None:
+        output.write("</{}>\n".format(root))
+
+# mediainfo writes XML fields with values such as "1920" and "7265.123"
+# since version 17.10, and "1 920 pixels" and "2h 1mn" before.
+def parse_number(text):
+    match = NUMBER_REGEX.match(text or "")
+
+    return float(match.group(1).replace(" ", "")) if match else None
+
+def parse_duration(text):
+    # Returns the duration in seconds.
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        pass
+
+    parts = DURATION_REGEX.findall(text or "")
+
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts) if parts else None
+
+def parse_bitrate(text):
+    # Returns the bit rate in bits per second.
+    match = NUMBER_REGEX.match(text or "")
+
+    if not match or match.group(2).lower() not in BITRATE_UNITS:
+        return None
+
+    return int(float(match.group(1).replace(" ", "")) * BITRATE_UNITS[match.group(2).lower()])
+
+def track_value(track, *names):
+    # Returns the text of the first of the named fields the track has.
+    for name in names:
+        element = track.find(name) if track is not None else None
+
+        if element is not None and element.text:
+            return element.text.strip()
+
+    return None
+
+def inventory_record(filename, fragment):
+    # Returns the key fields of the mediainfo output of a file, as a dict
+    # with the keys in INVENTORY_FIELDS.
+    tracks = xml.etree.ElementTree.fromstring(fragment).iter("track")
+    general, video, audio = None, None, []
+
+    for track in tracks:
+        kind = track.get("type")
+
+        if kind == "General" and general is None: general = track
+        elif kind == "Video" and video is None: video = track
+        elif kind == "Audio": audio.append(track)
+
+    width = parse_number(track_value(video, "Width"))
+    height = parse_number(track_value(video, "Height"))
+    crc32 = CRC32_REGEX.findall(os.path.basename(filename))
+
+    try:
+        size = os.path.getsize(filename)
+    except EnvironmentError:
+        size = None
+
+    return {
+        "path": filename,
+        "size": size,
+        "duration": parse_duration(track_value(general, "Duration")),
+        "container": track_value(general, "Format"),
+        "video_codec": track_value(video, "Format"),
+        "audio_codecs": ",".join(collections.OrderedDict((track_value(track, "Format"), None) for track in audio if track_value(track, "Format"))) or None,
+        "width": int(width) if width else None,
+        "height": int(height) if height else None,
+        "bitrate": parse_bitrate(track_value(general, "OverallBitRate", "Overall_bit_rate")),
+        "crc32": crc32[-1].upper() if crc32 else None,
+    }
+
+def inventory_records(fragments):
+    # Yields the records of the (filename, fragment) tuples received.
+    for filename, fragment in fragments:
+        try:
+            yield inventory_record(filename, fragment)
+        except xml.etree.ElementTree.ParseError as error:
+            print >> sys.stderr, "Could not read the mediainfo output of {}: {}".format(filename, error)
+
+def write_csv(records, output):
+    writer = csv.DictWriter(output, INVENTORY_FIELDS)
+    writer.writeheader()
+
+    for record in records:
+        writer.writerow(record)
+
+def write_jsonl(records, output):
+    for record in records:
+        record["path"] = record["path"].decode("utf-8", "replace") # Filenames are not always valid UTF-8.
+        output.write(json.dumps(record, sort_keys = True) + "\n")
+
+def write_sqlite(records, filename):
+    # Replaces the inventory table of the database, indexing the fields
+    # usually queried once all the records are in.
+    db = sqlite3.connect(filename)
+    db.text_factory = str
+
+    try:
+        db.execute("DROP TABLE IF EXISTS inventory")
+        db.execute("CREATE TABLE inventory (path TEXT PRIMARY KEY, size INTEGER, duration REAL, container TEXT, video_codec TEXT, audio_codecs TEXT, width INTEGER, height INTEGER, bitrate INTEGER, crc32 TEXT)")
+        insert = "INSERT OR REPLACE INTO inventory VALUES ({})".format(", ".join("?" * len(INVENTORY_FIELDS)))
+
+        while True:
+            rows = [tuple(record[field] for field in INVENTORY_FIELDS) for record in itertools.islice(records, SQLITE_BATCH_SIZE)]
+
+            if not rows:
+                break
+
+            db.executemany(insert, rows)
+
+        for field in ("duration", "video_codec", "height", "crc32"):
+            db.execute("CREATE INDEX inventory_{0} ON inventory ({0})".format(field))
+
+        db.commit()
+
+    finally:
+        db.close()
+
+# Writers of the inventory as a table, by format; they receive the records
+# and the output file, or its name for SQLite.
+TABLE_WRITERS = collections.OrderedDict([
+    ("csv", write_csv),
+    ("jsonl", write_jsonl),
+    ("sqlite", write_sqlite),
+])
+
+def cached_fragments(filenames, cache):
+    # Yields the (filename, fragment) tuples of the cached files.
+    for filename in filenames:
+        fragment = cache.lookup(filename, file_key(filename))
+        if fragment: yield filename, fragment
+
+def batch_fragments(results):
+    # Yields the (filename, fragment) tuples of (batch, document) results.
+    for batch, document in results:
+        match = ROOT_REGEX.match(document or "")
+
+        if match:
+            for filename, fragment in split_files(batch, match.group(4)):
+                if fragment: yield filename, fragment
+
+def run_batches(filenames, args):
+    # Yields the (batch, document) results of mediainfo on the filenames,
+    # in order, as each batch finishes; at most two batches per job are in
+    # flight, and no more filenames are taken meanwhile.
+    pool = ThreadPool(args.jobs)
+    in_flight = collections.deque()
+
+    try:
+        for batch in batches(filenames, argument_space(), args.batch_size):
+            in_flight.append((batch, pool.apply_async(run_mediainfo, (batch,))))
+
+            if len(in_flight) >= 2 * args.jobs:
+                batch, result = in_flight.popleft()
+                yield batch, result.get()
+
+        while in_flight:
+            batch, result = in_flight.popleft()
+            yield batch, result.get()
+
+    finally:
+        pool.terminate()
+
+def make_inventory(args):
+    # mediainfo runs in batches, as many files per process as the command
+    # line allows, with up to args.jobs processes at once.
+    #
+    # With the cache, only new or changed files are probed, and the
+    # inventory is rebuilt from it. Otherwise, batches are written in
+    # order as they finish, so only those in flight are kept in memory.
+    #
+    # Tables are written as records are read, in the requested format.
+    if args.format == "sqlite":
+        output = args.output
+    else:
+        output = open(args.output, "w") if args.output else sys.stdout
+
+    try:
+        if args.no_cache:
+            results = run_batches(video_files(args), args)
+
+            try:
+                if args.format == "xml":
+                    write_inventory((document for batch, document in results), output)
+                else:
+                    TABLE_WRITERS[args.format](inventory_records(batch_fragments(results)), output)
+            finally:
+                results.close()
+
+        else:
+            cache = ProbeCache(args.cache)
+            try:
+                filenames, probed = probe_files(video_files(args), args, cache)
+                pruned = cache.prune()
+
+                if args.format == "xml":
+                    write_cached_inventory(filenames, cache, output)
+                else:
+                    TABLE_WRITERS[args.format](inventory_records(cached_fragments(filenames, cache)), output)
+            finally:
+                cache.close()
+
+            if args.verbose: print >> sys.stderr, "{} files, {} probed, {} deleted files evicted from the cache".format(len(filenames), probed, pruned)
+
+    except OSError as error:
+        sys.exit("Could not run {}: {}".format(MEDIAINFO[0], error.strerror))
+
+    finally:
+        if output not in (sys.stdout, args.output): output.close()
+
+def setup_parser(prog = None):
+    parser = argparse.ArgumentParser(prog = prog, description = "Makes an inventory of video files with mediainfo.")
+    parser.add_argument("-o", "--output",                               help = "File where the inventory is written (default: standard output).")
+    parser.add_argument("-f", "--format",     choices = ["xml"] + list(TABLE_WRITERS), default = "xml", help = "Format of the inventory: the mediainfo XML, or a table of its key fields.")
+    parser.add_argument("-j", "--jobs",       type = positive_int, default = multiprocessing.cpu_count(), help = "Number of mediainfo processes run at once.")
+    parser.add_argument("-b", "--batch-size", type = positive_int, default = DEFAULT_BATCH_SIZE, help = "Maximum number of files per mediainfo process, as long as the command line allows them.")
+    parser.add_argument("-r", "--recursive",  action = "store_true",          help = "Looks for video files in subdirectories, too.")
+    parser.add_argument("-e", "--extensions", type = extensions_type, default = extensions_type(DEFAULT_EXTENSIONS), help = "Comma separated extensions of video files (default: {}).".format(DEFAULT_EXTENSIONS))
+    parser.add_argument("-s", "--sniff",      action = "store_true",          help = "Also takes files with other extensions whose contents are those of a video.")
+    parser.add_argument("--cache",      default = DEFAULT_CACHE_FILE,   help = "File where the mediainfo output of each file is cached.")
+    parser.add_argument("--no-cache",   action = "store_true",          help = "Probes every file, without using the cache.")
+    parser.add_argument("-v", "--verbose",    action = "store_true",          help = "Shows how many files were probed and evicted from the cache.")
+    parser.add_argument("FILES", nargs = "+")
+    parser.set_defaults(func = make_inventory)
+
+    return parser
+
+def main(argv = None, prog = None):
+    parser = setup_parser(prog)
+    args = parser.parse_args(argv)
+
+    if args.format == "sqlite" and not args.output:
+        parser.error("the sqlite format needs --output")
+
+    return args.func(args) # Executes the default function associated to the chosen operation.
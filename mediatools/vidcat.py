@@ -0,0 +1,530 @@
+#
+# Copyright 2013 Guillermo Barriga Placencia <gbarrigap@yahoo.es>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# 
+
+# 
+# This script, should be used to concatenate video files obtained
+# from a streamed source, such as:
+# curl http://edge-30-us.edge.mdstrm.com/media-us/_definst_/smil:52a338f4362d187131000005/media_b623000_[0-247].ts?access_token=53e7035668cec94c17f1649a27cff2d4-9dbc290e842d6c80da12a499a5c3643d -o "#1.ts"
+# 
+
+import sys # sys.argv
+import getopt
+import os # os.listdir
+import re
+import time
+import errno
+import collections
+import itertools
+
+from mediatools.files import iter_dir, filter_by_extension, sort_nicely
+from mediatools.hashes import CRC32, get_hashed_filename
+from mediatools.prompts import confirm
+
+DEBUG = True
+COPY_CHUNK_SIZE = 2**23 # 8MB
+DEFAULT_FETCH_JOBS = 4
+MANIFEST_EXTENSION = ".manifest"
+DEFAULT_EXTENSION = ".ts"
+SHORT_OPTIONS = "d:o:e:P:t:u:J:R:sl:p:m:rnVTD:ayqh"
+LONG_OPTIONS = ["dir=", "out=", "ext=", "playlist=", "pattern=", "url=", "fetch-jobs=", "retries=", "skip-missing", "limit=", "prefetch=",
+                "manifest=", "resume", "no-checksum", "verify", "tag", "delimiter=", "ask", "yes", "quiet", "help"]
+RANGE_REGEX = re.compile(r'\[([0-9]+)-([0-9]+)(?::([0-9]+))?\]')
+
+def kernel_copy_functions():
+  # Returns the functions able to copy data between two files inside the
+  # kernel, best first, as copy(src_fd, dst_fd, count) -> bytes copied.
+  # They are taken from the os module when this Python has them, and
+  # from the C library otherwise (Python 2).
+  import ctypes
+  from mediatools.libc import libc_function
+
+  functions = []
+
+  if not sys.platform.startswith("linux"):
+    return functions
+
+  if hasattr(os, "copy_file_range"):
+    functions.append(lambda src, dst, count: os.copy_file_range(src, dst, count))
+  else:
+    copy_file_range = libc_function("copy_file_range", ctypes.c_ssize_t,
+      [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint])
+    if copy_file_range:
+      functions.append(lambda src, dst, count: copy_file_range(src, None, dst, None, count, 0))
+
+  if hasattr(os, "sendfile"):
+    functions.append(lambda src, dst, count: os.sendfile(dst, src, None, count))
+  else:
+    sendfile = libc_function("sendfile", ctypes.c_ssize_t, [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t])
+    if sendfile:
+      functions.append(lambda src, dst, count: sendfile(dst, src, None, count))
+
+  return functions
+
+def kernel_copies():
+  # Returns the kernel copy functions that have not failed on this
+  # system, yet, looking them up on the first copy.
+  if kernel_copies.functions is None:
+    kernel_copies.functions = kernel_copy_functions()
+  return kernel_copies.functions
+
+kernel_copies.functions = None
+
+def append_file(src, dst, hashers=()):
+  # Appends the contents of the src file to the dst file, both open, and
+  # returns the number of bytes copied, updating the hashers, such as
+  # CRC32 objects, with them. Without hashers, the data is copied by the
+  # kernel when possible, without passing through this process;
+  # otherwise it is read into a reusable buffer.
+  copies = [] if hashers else kernel_copies()
+  for copy in list(copies):
+    copied = 0
+    try:
+      while True:
+        count = copy(src.fileno(), dst.fileno(), COPY_CHUNK_SIZE)
+        if count == 0:
+          return copied
+        copied += count
+    except OSError as error:
+      # Not supported for these files, e.g. across filesystems on older
+      # kernels; fall back to the next way of copying.
+      if copied or error.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+        raise
+      copies.remove(copy)
+
+  buffer_view = memoryview(append_file.buffer)
+  copied = 0
+  while True:
+    count = src.readinto(append_file.buffer)
+    if not count:
+      break
+    dst.write(buffer_view[:count])
+    for hasher in hashers:
+      hasher.update(buffer_view[:count])
+    copied += count
+
+  # Later kernel copies go straight to the file descriptor.
+  dst.flush()
+  return copied
+
+append_file.buffer = bytearray(COPY_CHUNK_SIZE)
+
+def hash_file_range(input_file, size, hashers):
+  # Updates the hashers with the next size bytes of the open file, and
+  # returns False if the file is shorter than that.
+  left = size
+  while left > 0:
+    data = input_file.read(min(left, COPY_CHUNK_SIZE))
+    if not data:
+      return False
+    for hasher in hashers:
+      hasher.update(data)
+    left -= len(data)
+  return True
+
+def file_crc32(input_file, size):
+  # Returns the CRC32 of the next size bytes of the open file, or None if
+  # the file is shorter than that.
+  cksum = CRC32()
+  return cksum.hexdigest() if hash_file_range(input_file, size, [cksum]) else None
+
+# Manifests list the segments of an output file, one per line, as
+# "offset<TAB>size<TAB>crc32<TAB>name"; crc32 is "-" when not recorded.
+def manifest_line(offset, size, cksum, name):
+  return "{}\t{}\t{}\t{}\n".format(offset, size, cksum or "-", name)
+
+def read_manifest(filename):
+  # Returns the (offset, size, crc32, name) entries of the manifest,
+  # stopping at a line torn by a crash.
+  entries = []
+  if not os.path.isfile(filename):
+    return entries
+
+  with open(filename) as manifest_file:
+    for line in manifest_file:
+      if line.startswith("#"):
+        continue
+      fields = line.rstrip("\n").split("\t", 3)
+      if not line.endswith("\n") or len(fields) != 4:
+        break
+      offset, size, cksum, name = fields
+      entries.append((int(offset), int(size), None if cksum == "-" else cksum, name))
+
+  return entries
+
+def write_manifest(filename, entries):
+  # Rewrites the whole manifest through a temporary file.
+  with open(filename + ".tmp", "w") as manifest_file:
+    manifest_file.write("# offset\tsize\tcrc32\tname\n")
+    for entry in entries:
+      manifest_file.write(manifest_line(*entry))
+  os.rename(filename + ".tmp", filename)
+
+def verify_segments(output_file, entries):
+  # Yields (entry, ok) tuples, checking the size and, when recorded, the
+  # CRC32 of each segment listed in the manifest against the output file.
+  output_size = os.fstat(output_file.fileno()).st_size
+  for entry in entries:
+    offset, size, cksum, name = entry
+    if offset + size > output_size:
+      yield entry, False
+    elif cksum is None:
+      yield entry, True
+    else:
+      output_file.seek(offset)
+      yield entry, file_crc32(output_file, size) == cksum
+
+def verify_output(filename_out, filename_manifest, quiet):
+  # Checks an output file against its manifest, without the segments.
+  entries = read_manifest(filename_manifest)
+  count_ok, count_fail = 0, 0
+
+  with open(filename_out, "rb") as output_file:
+    for (offset, size, cksum, name), ok in verify_segments(output_file, entries):
+      if ok:
+        count_ok += 1
+        if not quiet: print "{} [OK]".format(name)
+      else:
+        count_fail += 1
+        print "{} [Fail]".format(name)
+
+    if entries and os.fstat(output_file.fileno()).st_size != entries[-1][0] + entries[-1][1]:
+      count_fail += 1
+      print "{} [Fail] size does not match the manifest".format(filename_out)
+
+  print "{} segments verified, {} OK, {} Failed".format(len(entries), count_ok, count_fail)
+  return count_fail == 0
+
+def read_file(filename):
+  with open(filename, "rb") as input_file:
+    return input_file.read()
+
+def prefetch_files(filenames, window, read=read_file):
+  # Yields (filename, contents) tuples in the same order as the received
+  # filenames, while a pool of threads reads the next ones. At most
+  # window files are read ahead, so memory use is capped at window + 1
+  # files, whatever their number. Files are read with the read function,
+  # which may as well download them.
+  from multiprocessing.pool import ThreadPool
+
+  filenames = iter(filenames)
+  pool = ThreadPool(window)
+  pending = collections.deque()
+
+  try:
+    for filename in itertools.islice(filenames, window):
+      pending.append((filename, pool.apply_async(read, (filename,))))
+
+    while pending:
+      filename, result = pending.popleft()
+
+      # Keep the window full while this file is written.
+      for next_filename in itertools.islice(filenames, 1):
+        pending.append((next_filename, pool.apply_async(read, (next_filename,))))
+
+      yield filename, result.get()
+  finally:
+    pool.terminate()
+
+def expand_pattern(pattern):
+  # Yields the file names described by a pattern with a numeric range, in
+  # the syntax of curl: "media_[0-247].ts" -> media_0.ts ... media_247.ts.
+  # A first number with leading zeros pads all of them to its width, as
+  # in "[000-247]", and a step may follow, as in "[0-100:10]".
+  match = RANGE_REGEX.search(pattern)
+  if not match:
+    raise ValueError("{} has no range such as [0-247]".format(pattern))
+
+  first, last, step = match.group(1), match.group(2), match.group(3)
+  width = len(first) if first.startswith("0") else 0
+  prefix, suffix = pattern[:match.start()], pattern[match.end():]
+
+  for n in range(int(first), int(last) + 1, int(step or 1)):
+    yield "{}{}{}".format(prefix, str(n).zfill(width), suffix)
+
+def read_playlist(filename):
+  # Yields the names of the segments of an HLS playlist (.m3u8), in the
+  # order they are played. URIs are reduced to their file names, as the
+  # segments are expected to have been downloaded into a directory.
+  with open(filename) as playlist_file:
+    for line in playlist_file:
+      line = line.strip()
+      if line and not line.startswith("#"):
+        yield os.path.basename(line.split("?")[0])
+
+# Check args and print usage or continue, accordingly.
+usage_message  = '''\
+Usage: vidcat.py --dir=PATH --out=FILENAME [--ext=EXT | --playlist=M3U8 | --pattern=PATTERN [--skip-missing]] [--limit=LIMIT] [--prefetch=N] [--resume] [--no-checksum] [--tag [--delimiter=D]] [--ask] [--yes] [--quiet]
+       vidcat.py --url=URL --out=FILENAME [--fetch-jobs=N] [--retries=N] [--limit=LIMIT] [--resume] ...
+       vidcat.py --verify --out=FILENAME
+
+    --dir=/path/to/dir/ -d /path/to/dir/ path of the directory with the files.
+    --out=out_file      -o out_file      name of the output file.
+    --ext=ext           -e ext           filters by file extension (default: .ts).
+    --playlist=file     -P file          takes the segments, in order, from an .m3u8 playlist
+                                         instead of sorting the file names.
+    --pattern=pattern   -t pattern       takes the segments from a numeric range, as curl does,
+                                         e.g. media_[0-247].ts or media_[000-247].ts.
+    --skip-missing      -s               with --pattern, skips the files that do not exist,
+                                         instead of refusing to start.
+    --url=url           -u url           downloads the segments instead, from an .m3u8 playlist or
+                                         a numeric range, e.g. http://host/media_[0-247].ts?token=x,
+                                         writing them as they arrive.
+    --fetch-jobs=n      -J n             with --url, downloads up to n segments at once (default: 4).
+    --retries=n         -R n             with --url, retries failed downloads n times (default: 3).
+    --limit=limit       -l limit         how many files will be processed.
+    --prefetch=n        -p n             reads up to n files ahead, in parallel, while writing.
+    --manifest=file     -m file          manifest of the segments (default: out_file.manifest).
+    --resume            -r               checks the output file against its manifest, and
+                                         continues from the first segment missing.
+    --no-checksum       -n               does not record CRC32s in the manifest, which allows
+                                         copying without reading the files.
+    --tag               -T               appends the CRC32 of the output file to its name, as
+                                         fck does, e.g. out_file_[1A2B3C4D].ts, computing it
+                                         while the file is written.
+    --delimiter=d       -D d             with --tag, the delimiter before the CRC32 (default: _).
+    --verify            -V               checks the output file against its manifest.
+    --ask               -a               asks for user confirmation of each action.
+    --yes               -y               on verbose execution, asumes "yes" to all prompts.
+    --quiet             -q               run silently (overrides '--ask').
+'''
+
+def show_help(prog=None):
+  print usage_message.replace("vidcat.py", prog) if prog else usage_message
+  sys.exit(0)
+
+def main(argv=None, prog=None):
+  argv = sys.argv[1:] if argv is None else argv
+  if DEBUG: print argv
+
+  # Init some variables.
+  vids_dir = None
+  filename_out = None
+  filename_ext = DEFAULT_EXTENSION
+  filename_playlist = None
+  pattern = None
+  url = None
+  fetch_jobs = DEFAULT_FETCH_JOBS
+  retries = 3
+  skip_missing = False
+  limit = 0
+  prefetch = 0
+  filename_manifest = None
+  resume   = False
+  checksum = True
+  verify   = False
+  tag      = False
+  delimiter = "_"
+  ask   = False
+  yes   = False
+  quiet = False
+
+  try:
+    opts, args = getopt.getopt(argv, SHORT_OPTIONS, LONG_OPTIONS)
+  except getopt.GetoptError:
+    sys.exit(usage_message)
+
+  if args: sys.exit(usage_message)
+
+  for opt, value in opts:
+    if opt in ("--dir", "-d"):            vids_dir = value
+    elif opt in ("--out", "-o"):          filename_out = value
+    elif opt in ("--ext", "-e"):          filename_ext = value
+    elif opt in ("--playlist", "-P"):     filename_playlist = value
+    elif opt in ("--pattern", "-t"):      pattern = value
+    elif opt in ("--url", "-u"):          url = value
+    elif opt in ("--fetch-jobs", "-J"):   fetch_jobs = int(value)
+    elif opt in ("--retries", "-R"):      retries = int(value)
+    elif opt in ("--skip-missing", "-s"): skip_missing = True
+    elif opt in ("--limit", "-l"):        limit = int(value)
+    elif opt in ("--prefetch", "-p"):     prefetch = int(value)
+    elif opt in ("--manifest", "-m"):     filename_manifest = value
+    elif opt in ("--resume", "-r"):       resume = True
+    elif opt in ("--no-checksum", "-n"):  checksum = False
+    elif opt in ("--verify", "-V"):       verify = True
+    elif opt in ("--tag", "-T"):          tag = True
+    elif opt in ("--delimiter", "-D"):    delimiter = value
+    elif opt in ("--ask", "-a"):          ask = True
+    elif opt in ("--yes", "-y"):          yes = True
+    elif opt in ("--quiet", "-q"):        quiet = True
+    elif opt in ("--help", "-h"):         show_help(prog)
+
+  if not filename_out: sys.exit(usage_message)
+
+  if not filename_manifest: filename_manifest = filename_out + MANIFEST_EXTENSION
+
+  if verify:
+    return 0 if verify_output(filename_out, filename_manifest, quiet) else 1
+
+  if not filename_ext.startswith("."): filename_ext = "." + filename_ext
+  filename_ext = filename_ext.lower()
+
+  # Segments are downloaded from the URL, taken from the pattern or the
+  # playlist, in order, or else from the directory, filtering by
+  # extension before sorting the names. Downloaded segments are named
+  # after the last part of their URLs.
+  urls = None
+  fetch_errors = () # Download errors, only possible with --url.
+
+  if url:
+    from mediatools.hls import Fetcher, FetchError, segment_name, is_playlist, playlist_segments
+    fetch_errors = FetchError
+    fetcher = Fetcher(retries)
+    try:
+      urls = playlist_segments(fetcher, url) if is_playlist(url) else list(expand_pattern(url))
+    except (ValueError, FetchError) as error:
+      sys.exit(str(error))
+    if limit > 0: urls = urls[:limit]
+    files = [segment_name(u) for u in urls]
+  elif pattern:
+    if vids_dir is None: vids_dir = "."
+    try:
+      files = list(expand_pattern(pattern))
+    except ValueError as error:
+      sys.exit(str(error))
+    missing = [f for f in files if not os.path.isfile(os.path.join(vids_dir, f))]
+    if missing:
+      for f in missing:
+        print >> sys.stderr, "{} [Missing]".format(os.path.join(vids_dir, f))
+      if not skip_missing:
+        sys.exit("{} files missing; use --skip-missing to concatenate the rest.".format(len(missing)))
+      missing = set(missing)
+      files = [f for f in files if f not in missing]
+    if limit > 0: files = files[:limit]
+  elif filename_playlist:
+    if vids_dir is None: vids_dir = os.path.dirname(filename_playlist) or "."
+    files = read_playlist(filename_playlist)
+    files = list(itertools.islice(files, limit) if limit > 0 else files)
+  else:
+    files = (os.path.basename(path) for path, is_dir, st in iter_dir(vids_dir) if not is_dir)
+    files = list(filter_by_extension(files, [filename_ext]))
+    files = sort_nicely(files, limit)
+
+  if not files:
+    sys.exit("No files to concatenate.")
+
+  files_count = len(files)
+  files_firts = files[0]
+  files_last  = files[files_count - 1]
+
+  # Calculate the number of digits of the file count,
+  # to use it for padding the counter in the progress indicator.
+  files_count_char_count = len(str(files_count))
+
+  if ask and not quiet:
+    prompt = "I'm about to process {} files; from {} to {}. Shall I continue with the task, sire?"
+    if not confirm(prompt.format(files_count, files_firts, files_last)):
+      return 1
+
+  # When resuming, keep the segments of the output that match both the
+  # manifest and the list of files, and continue after the last of them.
+  entries = []
+  offset = 0
+
+  if resume and os.path.isfile(filename_out):
+    with open(filename_out, "rb") as output_file:
+      for n, (entry, ok) in enumerate(verify_segments(output_file, read_manifest(filename_manifest))):
+        if not ok or n >= files_count or entry[3] != os.path.basename(files[n]) or entry[0] != offset:
+          break
+        entries.append(entry)
+        offset += entry[1]
+
+    if not quiet: print "Resuming after {} segments.".format(len(entries))
+
+  # With --tag, the CRC32 of the whole output is computed along with those
+  # of the segments, as they are written; when resuming, the part of the
+  # output kept has to be read again for it.
+  output_crc = CRC32() if tag else None
+
+  if output_crc and offset:
+    with open(filename_out, "rb") as output_file:
+      hash_file_range(output_file, offset, [output_crc])
+
+  # The output file is opened once, and every file is streamed into it.
+  # With --prefetch, the next files are read while the current one is
+  # written; otherwise each one is copied as it comes (contents is None).
+  # Every segment is recorded in the manifest once it has been written.
+  processed_files_count = len(entries)
+  processed_bytes_count = 0
+  start_time = time.time()
+
+  if urls:
+    segments = prefetch_files(urls[len(entries):], max(fetch_jobs, 1), fetcher.fetch)
+  else:
+    paths = [os.path.join(vids_dir, f) for f in files[len(entries):]]
+    segments = prefetch_files(paths, prefetch) if prefetch > 0 else ((f, None) for f in paths)
+
+  write_manifest(filename_manifest, entries)
+
+  # A failed download stops the run; the manifest lists what was written,
+  # so it may be resumed.
+  try:
+    with open(filename_out, "r+b" if entries else "wb") as output_file, open(filename_manifest, "a") as manifest_file:
+      output_file.truncate(offset)
+      output_file.seek(offset)
+
+      for name, (f, contents) in itertools.izip(files[len(entries):], segments):
+        message = "Appending {} to {}".format(f, filename_out)
+
+        if ask and not quiet:
+          if not confirm("About to append {} to {}. Continue?".format(f, filename_out)):
+            return 1
+
+        elif not quiet:
+          print message,
+
+        segment_crc = CRC32() if checksum else None
+        hashers = [hasher for hasher in (segment_crc, output_crc) if hasher]
+
+        if contents is None:
+          with open(f, "rb") as input_file:
+            size = append_file(input_file, output_file, hashers)
+        else:
+          output_file.write(contents)
+          output_file.flush()
+          size = len(contents)
+          for hasher in hashers:
+            hasher.update(contents)
+
+        cksum = segment_crc.hexdigest() if segment_crc else None
+        manifest_file.write(manifest_line(offset, size, cksum, os.path.basename(name)))
+        manifest_file.flush()
+
+        offset += size
+        processed_bytes_count += size
+        processed_files_count += 1
+        if not quiet: print "[{}/{}]".format(str(processed_files_count).rjust(files_count_char_count), files_count)
+  except fetch_errors as error:
+    sys.exit("{}\nRun again with --resume to continue.".format(error))
+
+  elapsed_time = time.time() - start_time
+
+  if output_crc:
+    filename_tagged = get_hashed_filename(filename_out, output_crc.hexdigest(), delimiter)
+    os.rename(filename_out, filename_tagged)
+
+    # The default manifest follows its output file.
+    if filename_manifest == filename_out + MANIFEST_EXTENSION:
+      os.rename(filename_manifest, filename_tagged + MANIFEST_EXTENSION)
+
+    if not quiet: print "{} renamed to {}".format(filename_out, filename_tagged)
+
+  if not quiet:
+    print "{} files where successfully processed. Bye!".format(processed_files_count)
+    print "{} bytes copied in {:.2f}s ({:.1f} MB/s).".format(processed_bytes_count, elapsed_time,
+      processed_bytes_count / elapsed_time / 2**20 if elapsed_time else 0)
+
+  return 0
@@ -0,0 +1,163 @@
+#
+# Copyright 2013 Guillermo Barriga Placencia <gbarrigap@yahoo.es>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+#
+# Tests the HLS fetcher, and vidcat --url, against a local HTTP server
+# standing in for a streaming server.
+#
+# Usage: python -m unittest discover -s tests
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+import SocketServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mediatools import hls, vidcat
+
+SEGMENTS = 3
+
+PLAYLISTS = {
+    "/media.m3u8": "#EXTM3U\n#EXT-X-TARGETDURATION:10\n" + "".join("#EXTINF:10,\nseg_{}.ts\n".format(n) for n in range(SEGMENTS)) + "#EXT-X-ENDLIST\n",
+    "/low/media.m3u8": "#EXTM3U\n#EXTINF:10,\nlow_0.ts\n#EXT-X-ENDLIST\n",
+    "/master.m3u8": "#EXTM3U\n#EXT-X-STREAM-INF:PROGRAM-ID=1,BANDWIDTH=100000\nlow/media.m3u8\n"
+                    "#EXT-X-STREAM-INF:PROGRAM-ID=1,BANDWIDTH=500000\nmedia.m3u8\n",
+}
+
+def segment(n):
+    return "segment {}\n".format(n) * 100
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Serves segments and playlists over HTTP/1.1, keeping connections
+    # open as streaming servers do. /flaky fails with 503 on its first
+    # request, /moved redirects to a segment, and anything else is 404.
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        self.server.requests.append(path)
+
+        if path in PLAYLISTS:
+            self.answer(200, PLAYLISTS[path])
+
+        elif path.startswith("/seg_") and path.endswith(".ts") and path[5:-3].isdigit():
+            self.answer(200, segment(int(path[5:-3])))
+
+        elif path == "/flaky":
+            self.answer(200, segment(0)) if self.server.requests.count(path) > 1 else self.answer(503, "")
+
+        elif path == "/moved":
+            self.answer(302, "", {"Location": "/seg_1.ts"})
+
+        else:
+            self.answer(404, "")
+
+    def answer(self, status, body, headers = {}):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class FetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer(("127.0.0.1", 0), StandInHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.base = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        self.fetcher = hls.Fetcher(retries = 2)
+        self.retry_delay, hls.RETRY_DELAY = hls.RETRY_DELAY, 0
+
+    def tearDown(self):
+        hls.RETRY_DELAY = self.retry_delay
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_fetch(self):
+        self.assertEqual(self.fetcher.fetch(self.base + "/seg_2.ts?token=x"), segment(2))
+
+    def test_playlist(self):
+        segments = hls.playlist_segments(self.fetcher, self.base + "/media.m3u8")
+
+        self.assertEqual(segments, [self.base + "/seg_{}.ts".format(n) for n in range(SEGMENTS)])
+        self.assertEqual([hls.segment_name(url) for url in segments], ["seg_{}.ts".format(n) for n in range(SEGMENTS)])
+
+    def test_master_playlist(self):
+        # The variant with the highest bandwidth is taken.
+        segments = hls.playlist_segments(self.fetcher, self.base + "/master.m3u8")
+
+        self.assertEqual(segments, [self.base + "/seg_{}.ts".format(n) for n in range(SEGMENTS)])
+
+    def test_retry(self):
+        self.assertEqual(self.fetcher.fetch(self.base + "/flaky"), segment(0))
+        self.assertEqual(self.server.requests.count("/flaky"), 2)
+
+    def test_redirect(self):
+        self.assertEqual(self.fetcher.fetch(self.base + "/moved"), segment(1))
+
+    def test_not_found(self):
+        # Client errors are not retried.
+        self.assertRaises(hls.FetchError, self.fetcher.fetch, self.base + "/missing.ts")
+        self.assertEqual(self.server.requests.count("/missing.ts"), 1)
+
+    def test_vidcat_range(self):
+        directory = tempfile.mkdtemp()
+
+        try:
+            output = os.path.join(directory, "out.ts")
+            vidcat.main(["--url=" + self.base + "/seg_[0-{}].ts?token=x".format(SEGMENTS - 1), "--out=" + output, "--fetch-jobs=2", "--quiet"])
+
+            with open(output, "rb") as output_file:
+                self.assertEqual(output_file.read(), "".join(segment(n) for n in range(SEGMENTS)))
+
+        finally:
+            shutil.rmtree(directory)
+
+    def test_vidcat_missing_segment(self):
+        directory = tempfile.mkdtemp()
+
+        try:
+            output = os.path.join(directory, "out.ts")
+
+            with self.assertRaises(SystemExit):
+                vidcat.main(["--url=" + self.base + "/missing_[0-1].ts", "--out=" + output, "--quiet"])
+
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,21 +1,28 @@
 #!/usr/bin/python
 
+#
+# This script is kept for compatibility: it concatenates the files
+# {filename_base}_0.ts ... {filename_base}_{file_count - 1}.ts into
+# filename_out, which is now done by vidcat --pattern.
+#
+# Usage: vidconcat.py filename_base file_count filename_out
+#
+
 import sys # sys.argv
-import os # os.system
+
+from mediatools import vidcat
 
 DEBUG = False
 
+if len(sys.argv) != 4:
+  sys.exit("Usage: vidconcat.py filename_base file_count filename_out")
+
 filename_base = sys.argv[1]
 file_count    = int(sys.argv[2])
 filename_out  = sys.argv[3]
 
-# Check args and print usage or continue, accordingly.
+arguments = ["--pattern={}_[0-{}].ts".format(filename_base, file_count - 1), "--out={}".format(filename_out)]
 
-for n in range(file_count):
-  command = "cat {}_{}.ts {} {}".format(filename_base, n, (">" if n is 0 else ">>"), filename_out)
-  
-  if DEBUG raw_input("About to execute {}".format(command))
-  
-  os.system(command)
+if DEBUG: raw_input("About to run vidcat {}".format(" ".join(arguments)))
 
-print "{} files processed. Program terminated!".format(file_count)
+sys.exit(vidcat.main(arguments))